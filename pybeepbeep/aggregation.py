@@ -0,0 +1,152 @@
+import numpy as np
+
+
+class DistanceAggregator:
+    """
+    Combines the distance matrices of many rounds into running per-pair estimates without keeping past rounds.
+
+    Every pair keeps an exponentially weighted mean and variance, a streaming median estimate and counts of accepted,
+    rejected and missing (inf or nan) measurements, so memory is fixed per pair regardless of the number of rounds.
+    After warmup measurements, a measurement further than outlier_sigma standard deviations from the mean is rejected,
+    unless max_rejections measurements in a row have been rejected, in which case the pair is assumed to have moved
+    and the measurement is accepted.
+
+    Distances are quantized to whole samples, so repeated rounds often measure exactly the same distance and the
+    measured spread can be zero. The spread used for rejection, the median's steps and confidence is therefore never
+    below min_std, which defaults to the distance of one sample at 44.1 kHz. Use c / (2 * sampling_freq_hz) for
+    other sampling frequencies.
+    """
+
+    def __init__(self,
+                 n_nodes: int,
+                 alpha: float = 0.1,
+                 outlier_sigma: float = 4.0,
+                 warmup: int = 5,
+                 max_rejections: int = 3,
+                 min_std: float = 343 / (2 * 44100)):
+        if not 0 < alpha <= 1:
+            raise ValueError("alpha must be in (0, 1]")
+
+        self.n_nodes = n_nodes
+        self.alpha = alpha
+        self.outlier_sigma = outlier_sigma
+        self.warmup = warmup
+        self.max_rejections = max_rejections
+        self.min_std = min_std
+
+        shape = (n_nodes, n_nodes)
+        self.mean = np.zeros(shape)
+        self.var = np.zeros(shape)
+        self.median = np.zeros(shape)
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.missing = np.zeros(shape, dtype=np.int64)
+        self.rejected = np.zeros(shape, dtype=np.int64)
+        self._rejection_streak = np.zeros(shape, dtype=np.int64)
+
+    def update(self, distances: np.ndarray):
+        """
+        Adds one round's distance matrix from calculate_distances.
+        """
+        distances = np.asarray(distances, dtype=np.float64)
+        if distances.shape != self.mean.shape:
+            raise ValueError("Expected a {0}x{0} distance matrix".format(self.n_nodes))
+
+        self._update(np.arange(distances.size), distances.ravel())
+
+    def update_pairs(self, rows: np.ndarray, columns: np.ndarray, distances: np.ndarray):
+        """
+        Adds measurements for only some pairs, distances[k] being the distance between rows[k] and columns[k]. Only
+        the given pairs are touched, so the cost grows with the number of pairs rather than the number of nodes.
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        columns = np.asarray(columns, dtype=np.intp)
+        distances = np.asarray(distances, dtype=np.float64)
+
+        index = np.concatenate((rows * self.n_nodes + columns, columns * self.n_nodes + rows))
+        values = np.concatenate((distances, distances))
+
+        # a pair given more than once takes its last measurement
+        index, last = np.unique(index[::-1], return_index=True)
+        self._update(index, values[::-1][last])
+
+    def _update(self, index: np.ndarray, values: np.ndarray):
+        # index holds distinct flat indices into the state matrices, values the measurement for each of them
+        mean, var, median, count, missing, rejected, streak = (
+            state.reshape(-1) for state in (self.mean, self.var, self.median, self.count, self.missing,
+                                            self.rejected, self._rejection_streak)
+        )
+
+        finite = np.isfinite(values)
+        missing[index[~finite]] += 1
+        index, values = index[finite], values[finite]
+
+        first = count[index] == 0
+        mean[index[first]] = values[first]
+        median[index[first]] = values[first]
+        count[index[first]] = 1
+        index, values = index[~first], values[~first]
+
+        deviation = values - mean[index]
+        # the spread is unknown until two measurements arrived, nothing is rejected before that
+        outlier = ((count[index] >= max(self.warmup, 2))
+                   & (np.abs(deviation) > self.outlier_sigma * self._std(var[index], count[index]))
+                   & (streak[index] < self.max_rejections))
+        rejected[index[outlier]] += 1
+        streak[index[outlier]] += 1
+
+        accepted = ~outlier
+        index, values, deviation = index[accepted], values[accepted], deviation[accepted]
+        streak[index] = 0
+        count[index] += 1
+
+        alpha = self.alpha
+        increment = alpha * deviation
+        mean[index] += increment
+        var[index] = (1 - alpha) * (var[index] + deviation * increment)
+
+        # the median follows the sign of the error in steps proportional to the spread, until warmup it follows the
+        # mean since the spread is not yet known
+        warming_up = count[index] <= self.warmup
+        median[index[warming_up]] = mean[index[warming_up]]
+        tracking = index[~warming_up]
+        step = alpha * np.maximum(np.sqrt(var[tracking]), self.min_std)
+        median[tracking] += step * np.sign(values[~warming_up] - median[tracking])
+
+    def _unbiased_var(self, var: np.ndarray, count: np.ndarray) -> np.ndarray:
+        # the weighted variance starts at 0 and underestimates the spread until about 1 / alpha measurements arrived,
+        # a single measurement has no spread to correct, so it is taken as 0 and min_std applies
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(count > 1, var / (1 - (1 - self.alpha) ** np.maximum(count - 1, 0)), 0.0)
+
+    def _std(self, var: np.ndarray, count: np.ndarray) -> np.ndarray:
+        return np.sqrt(np.maximum(self._unbiased_var(var, count), self.min_std ** 2))
+
+    def estimate(self, robust: bool = True) -> np.ndarray:
+        """
+        Returns the current distance estimate for every pair, the streaming median if robust and the weighted mean
+        otherwise. Pairs that were never measured are nan and pairs that were never detected are inf.
+        """
+        estimate = np.array(self.median if robust else self.mean)
+        estimate[self.count == 0] = np.nan
+        estimate[(self.count == 0) & (self.missing > 0)] = np.inf
+        return estimate
+
+    def confidence(self) -> np.ndarray:
+        """
+        Returns the standard error of every pair's estimate, nan for pairs without measurements.
+
+        The weighted mean averages over roughly (2 - alpha) / alpha measurements, fewer until that many arrived. The
+        standard deviation is at least min_std, which is also the confidence after a single measurement.
+        """
+        effective_count = np.minimum(self.count, (2 - self.alpha) / self.alpha)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            error = self._std(self.var, self.count) / np.sqrt(effective_count)
+        error[self.count == 0] = np.nan
+        return error
+
+    def detection_rate(self) -> np.ndarray:
+        """
+        Returns the fraction of rounds in which every pair was detected, nan for pairs without any round.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (self.count + self.rejected) / (self.count + self.rejected + self.missing)
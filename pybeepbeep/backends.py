@@ -0,0 +1,219 @@
+import inspect
+import os
+from typing import Callable, List
+
+import numpy as np
+
+
+# numpy >= 2.0 can write FFT results into existing arrays
+_fft_supports_out = "out" in inspect.signature(np.fft.rfft).parameters
+
+_backend_factories = {}
+_backend_instances = {}
+_active_backend = None
+
+
+def _fft_into(fft: Callable, a: np.ndarray, out: np.ndarray, n: int = None) -> np.ndarray:
+    if _fft_supports_out:
+        return fft(a, n, out=out)
+    out[...] = fft(a, n)
+    return out
+
+
+class NumpyBackend:
+    """
+    The kernels behind detection and distance calculation, implemented with NumPy and SciPy.
+
+    Other backends subclass this and override the kernels they can run faster. Every kernel writes into the buffers
+    it is given where possible, the BeepDetector calling them owns and reuses those buffers. Windows shorter than the
+    template are the one exception, BeepDetector correlates those with scipy.signal directly on any backend.
+    """
+    name = "numpy"
+
+    def fft_correlate(self, padded: np.ndarray, template_spectrum: np.ndarray, spectrum: np.ndarray) -> np.ndarray:
+        """
+        Circularly correlates the zero padded samples in padded with the template whose conjugate spectrum is given,
+        writing the result back into padded.
+        """
+        _fft_into(np.fft.rfft, padded, out=spectrum)
+        spectrum *= template_spectrum
+        return _fft_into(np.fft.irfft, spectrum, out=padded, n=len(padded))
+
+    def envelope(self,
+                 correlation: np.ndarray,
+                 hilbert_weight: np.ndarray,
+                 analytic: np.ndarray,
+                 out: np.ndarray) -> np.ndarray:
+        """
+        Magnitude of the analytic signal of correlation, as np.abs(scipy.signal.hilbert(correlation)).
+        """
+        n_half = len(hilbert_weight)
+        _fft_into(np.fft.rfft, correlation, out=analytic[:n_half])
+        analytic[:n_half] *= hilbert_weight
+        analytic[n_half:] = 0
+        _fft_into(np.fft.ifft, analytic, out=analytic)
+        return np.abs(analytic, out=out)
+
+    def first_peak_above(self, envelope: np.ndarray, threshold: float, buffer: Callable = None) -> int:
+        """
+        Index of the first peak found by scipy.signal.find_peaks that is above threshold, or -1.
+
+        buffer(name, size, dtype) provides reusable scratch arrays, without it they are allocated for this call.
+        """
+        if buffer is None:
+            def buffer(name, size, dtype):
+                return np.empty(size, dtype=dtype)
+
+        n = len(envelope)
+        if n < 3:
+            return -1
+        diff = np.subtract(envelope[1:], envelope[:-1], out=buffer("peak_diff", n - 1, np.float64))
+        mask = buffer("peak_mask", n - 1, np.bool_)
+        rising = buffer("peak_rising", n - 1, np.bool_)
+
+        # find_peaks reports plateaus entered by a strict rise and left by a strict fall, at their midpoint. The first
+        # peak above threshold is the plateau ending at the first fall after the first sample that rises above it,
+        # since everything between that sample and the fall is non-decreasing.
+        np.greater(envelope[1:], threshold, out=mask)
+        np.greater(diff, 0, out=rising)
+        np.logical_and(mask, rising, out=mask)
+        first = int(np.argmax(mask))
+        if not mask[first]:
+            return -1
+        first += 1
+
+        falling = np.less(diff[first:], 0, out=mask[first:])
+        if len(falling) == 0 or not falling.any():
+            return -1
+        right = first + int(np.argmax(falling))
+
+        # the plateau starts after the last strict rise before it, which exists since the sample at first rose
+        left = right - int(np.argmax(rising[first - 1:right][::-1]))
+        return (left + right) // 2
+
+    def distances(self, deltas: np.ndarray, conversion_factor: float) -> np.ndarray:
+        """
+        See calculate_distances.
+        """
+        deltas_t = deltas.T
+
+        k1 = deltas * np.eye(deltas.shape[0]) @ np.ones(deltas.shape)
+        k2 = k1.T
+        k = k1 + k2
+
+        return conversion_factor * (np.abs(deltas - deltas_t) + k)
+
+
+class NumbaBackend(NumpyBackend):
+    """
+    Compiles peak picking and distance assembly with Numba. FFTs stay with NumPy.
+
+    Peak picking walks the envelope once and stops at the first qualifying peak instead of collecting every peak.
+    Both kernels return the same results as the NumPy backend, including find_peaks' handling of flat peaks and the
+    nan and inf entries calculate_distances returns for nodes with a missing detection.
+    """
+    name = "numba"
+
+    def __init__(self):
+        import numba
+
+        @numba.njit(cache=True, nogil=True)
+        def first_peak_above(x, threshold):
+            # the same walk as scipy.signal._peak_finding_utils._local_maxima_1d
+            i = 1
+            i_max = x.shape[0] - 1
+            while i < i_max:
+                if x[i - 1] < x[i]:
+                    i_ahead = i + 1
+                    while i_ahead < i_max and x[i_ahead] == x[i]:
+                        i_ahead += 1
+                    if x[i_ahead] < x[i]:
+                        midpoint = (i + i_ahead - 1) // 2
+                        if x[midpoint] > threshold:
+                            return midpoint
+                        i = i_ahead
+                i += 1
+            return -1
+
+        @numba.njit(cache=True, nogil=True)
+        def distances(deltas, conversion_factor):
+            n = deltas.shape[0]
+            k = np.empty(n)
+            for i in range(n):
+                # the NumPy backend multiplies the off-diagonal deltas by 0 in its matrix product, which turns a row
+                # into nan when any of them is not finite, while the diagonal itself is kept as is
+                k[i] = deltas[i, i]
+                for j in range(n):
+                    if j != i and not np.isfinite(deltas[i, j]):
+                        k[i] = np.nan
+            out = np.empty((n, n))
+            for i in range(n):
+                for j in range(n):
+                    out[i, j] = conversion_factor * (abs(deltas[i, j] - deltas[j, i]) + (k[i] + k[j]))
+            return out
+
+        self._first_peak_above = first_peak_above
+        self._distances = distances
+
+    def first_peak_above(self, envelope: np.ndarray, threshold: float, buffer: Callable = None) -> int:
+        return int(self._first_peak_above(envelope, threshold))
+
+    def distances(self, deltas: np.ndarray, conversion_factor: float) -> np.ndarray:
+        return self._distances(np.ascontiguousarray(deltas, dtype=np.float64), float(conversion_factor))
+
+
+def register_backend(name: str, factory: Callable[[], NumpyBackend]):
+    """
+    Makes a backend available by name. The factory is only called when the backend is first used and should raise
+    ImportError if the backend's dependencies are missing.
+    """
+    _backend_factories[name] = factory
+    _backend_instances.pop(name, None)
+
+
+def available_backends() -> List[str]:
+    """
+    Names of the registered backends whose dependencies are installed.
+    """
+    names = []
+    for name in _backend_factories:
+        try:
+            _instance(name)
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def _instance(name: str) -> NumpyBackend:
+    if name not in _backend_factories:
+        raise ValueError("Unknown backend {}, registered backends are {}".format(
+            name, ", ".join(_backend_factories.keys())))
+    if name not in _backend_instances:
+        _backend_instances[name] = _backend_factories[name]()
+    return _backend_instances[name]
+
+
+def set_backend(name: str):
+    """
+    Selects the backend used from now on by detection and distance calculation in this process.
+    """
+    global _active_backend
+    _active_backend = _instance(name)
+
+
+def get_backend(name: str = None) -> NumpyBackend:
+    """
+    Returns the named backend, or the selected one. Until set_backend is called, the backend named by the
+    PYBEEPBEEP_BACKEND environment variable is selected, defaulting to numpy.
+    """
+    global _active_backend
+    if name is not None:
+        return _instance(name)
+    if _active_backend is None:
+        _active_backend = _instance(os.environ.get("PYBEEPBEEP_BACKEND", NumpyBackend.name))
+    return _active_backend
+
+
+register_backend(NumpyBackend.name, NumpyBackend)
+register_backend(NumbaBackend.name, NumbaBackend)
@@ -0,0 +1,99 @@
+import hashlib
+import sqlite3
+import struct
+from typing import Optional, Tuple
+
+import numpy as np
+
+from pybeepbeep.ranging import Detection, _detector_version
+
+
+# bump whenever the table layout changes, existing stores with another layout are cleared on open
+_schema_version = 2
+
+
+class DetectionCache:
+    """
+    Persistent cache of beep detections keyed by the content of the searched window and the detection parameters.
+
+    Detections are stored in a local SQLite database. Once more than max_entries detections are stored the least
+    recently used ones are evicted. Each entry takes roughly 70 bytes on disk, so the default bound keeps the store
+    around 70MB. The cache is safe to share between processes as long as each process opens its own instance.
+    """
+
+    def __init__(self, path: str, max_entries: int = 1000000):
+        self.path = path
+        self.max_entries = max_entries
+        self._connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        if self._connection.execute("PRAGMA user_version").fetchone()[0] != _schema_version:
+            self._connection.execute("DROP TABLE IF EXISTS detections")
+            self._connection.execute("PRAGMA user_version = {}".format(_schema_version))
+        self._connection.execute("CREATE TABLE IF NOT EXISTS detections (key BLOB PRIMARY KEY, onset INTEGER, "
+                                 "peak_ratio REAL NOT NULL, snr_db REAL NOT NULL, last_used INTEGER NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS detections_last_used ON detections (last_used)")
+        self._clock, self._count = self._connection.execute(
+            "SELECT COALESCE(MAX(last_used), 0), COUNT(*) FROM detections"
+        ).fetchone()
+
+    @staticmethod
+    def key(samples: np.ndarray,
+            sampling_freq_hz: float,
+            target_signal_freq_hz: float,
+            duration_ms: float,
+            block_size: int = None,
+            min_snr_db: float = 20.0) -> bytes:
+        samples = np.ascontiguousarray(samples)
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(struct.pack("<Idddqd", _detector_version, sampling_freq_hz, target_signal_freq_hz, duration_ms,
+                                  0 if block_size is None else block_size, min_snr_db))
+        digest.update(samples.dtype.str.encode("ascii"))
+        digest.update(memoryview(samples).cast("B"))
+        return digest.digest()
+
+    def get(self, key: bytes) -> Tuple[bool, Optional[Detection]]:
+        """
+        Returns whether the key was found and, if so, the cached detection.
+        """
+        row = self._connection.execute("SELECT onset, peak_ratio, snr_db FROM detections WHERE key = ?",
+                                       (key,)).fetchone()
+        if row is None:
+            return False, None
+
+        self._clock += 1
+        self._connection.execute("UPDATE detections SET last_used = ? WHERE key = ?", (self._clock, key))
+        return True, Detection(*row)
+
+    def put(self, key: bytes, detection: Detection):
+        self._clock += 1
+        onset = None if detection.onset is None else int(detection.onset)
+        self._connection.execute("INSERT OR REPLACE INTO detections (key, onset, peak_ratio, snr_db, last_used) "
+                                 "VALUES (?, ?, ?, ?, ?)",
+                                 (key, onset, float(detection.peak_ratio), float(detection.snr_db), self._clock))
+        self._count += 1
+
+        if self._count > self.max_entries:
+            self._evict()
+
+    def _evict(self):
+        # evict an extra tenth so eviction runs once per batch of inserts rather than on every insert
+        self._count = self._connection.execute("SELECT COUNT(*) FROM detections").fetchone()[0]
+        excess = self._count - self.max_entries
+        if excess > 0:
+            excess += self.max_entries // 10
+            self._connection.execute("DELETE FROM detections WHERE key IN "
+                                     "(SELECT key FROM detections ORDER BY last_used LIMIT ?)", (excess,))
+            self._count = max(self._count - excess, 0)
+
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM detections").fetchone()[0]
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,302 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from pybeepbeep.cache import DetectionCache
+from pybeepbeep.ranging import BeepDetector, calculate_distances, find_deltas
+from pybeepbeep.wire import decode_schedule, encode_deltas, encode_distances
+
+
+_recording_extensions = (".wav", ".raw")
+
+# per worker process state, set once by _init_worker so tasks only carry a path
+_worker_schedule = None
+_worker_options = None
+_worker_cache = None
+_worker_detector = None
+
+
+def load_schedule(path: str) -> List[Dict]:
+    """
+    Loads a schedule saved either as JSON or in the binary format of pybeepbeep.wire.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if data.startswith(b"BEEP"):
+        return decode_schedule(data)
+    return json.loads(data.decode("utf-8"))
+
+
+def load_recording(path: str, sampling_freq_hz: float = None, raw_dtype: str = "float32") -> Tuple[np.ndarray, float]:
+    """
+    Memory-maps a WAV or headerless raw recording, only the first channel of multichannel WAVs is used.
+
+    Raw recordings carry no header so sampling_freq_hz and raw_dtype must describe them.
+    """
+    if path.lower().endswith(".wav"):
+        from scipy.io import wavfile
+
+        sampling_freq_hz, samples = wavfile.read(path, mmap=True)
+        if samples.ndim > 1:
+            samples = samples[:, 0]
+        return samples, float(sampling_freq_hz)
+
+    if sampling_freq_hz is None:
+        raise ValueError("A sampling rate is required to read raw recording {}".format(path))
+    return np.memmap(path, dtype=np.dtype(raw_dtype), mode='r'), float(sampling_freq_hz)
+
+
+def find_recordings(directory: str, schedule: List[Dict]) -> Dict[str, str]:
+    ids = {str(entry["id"]) for entry in schedule}
+    recordings = {}
+    for name in sorted(os.listdir(directory)):
+        node_id, extension = os.path.splitext(name)
+        if extension.lower() in _recording_extensions and node_id in ids:
+            recordings[node_id] = os.path.join(directory, name)
+    return recordings
+
+
+def _save_atomic(path: str, data):
+    # write next to the destination and rename so an interrupted run never leaves a partial result behind
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        if isinstance(data, np.ndarray):
+            np.save(f, data)
+        else:
+            f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _check_sampling_freq_hz(recordings: Dict[str, str], sampling_freq_hz: float):
+    # raw recordings would otherwise fail one by one in the workers
+    if sampling_freq_hz is not None:
+        return
+    raw = [path for path in recordings.values() if not path.lower().endswith(".wav")]
+    if len(raw) > 0:
+        raise ValueError("A sampling rate is required to read raw recordings such as {}".format(raw[0]))
+    if len(recordings) == 0:
+        raise ValueError("A sampling rate is required when no WAV recordings are present")
+
+
+def _run_digest(schedule: List[Dict], sampling_freq_hz: float, raw_dtype: str) -> str:
+    # identifies what the per-node deltas were computed from, the ids and order of the schedule included
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps([schedule, sampling_freq_hz, raw_dtype], sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _invalidate_stale_deltas(output_dir: str, deltas_dir: str, digest: str, log) -> int:
+    digest_path = os.path.join(output_dir, "run.digest")
+    previous = None
+    if os.path.exists(digest_path):
+        with open(digest_path, "r") as f:
+            previous = f.read().strip()
+
+    removed = 0
+    if previous != digest:
+        for name in os.listdir(deltas_dir):
+            if name.endswith(".npy"):
+                os.remove(os.path.join(deltas_dir, name))
+                removed += 1
+        if removed > 0:
+            print("schedule or options changed since the last run, discarded {} previous results".format(removed),
+                  file=log)
+        _save_atomic(digest_path, digest.encode("ascii"))
+    return removed
+
+
+def _init_worker(schedule: List[Dict], options: Dict):
+    global _worker_schedule, _worker_options, _worker_cache, _worker_detector
+    # one detector per worker, so its templates and buffers are reused across every recording the worker processes
+    _worker_detector = BeepDetector()
+    _worker_schedule = schedule
+    _worker_options = options
+    if options["cache_path"] is not None:
+        _worker_cache = DetectionCache(options["cache_path"])
+
+
+def _process_recording(node_id: str, recording_path: str, output_path: str) -> Tuple[str, int, float]:
+    samples, sampling_freq_hz = load_recording(recording_path,
+                                               sampling_freq_hz=_worker_options["sampling_freq_hz"],
+                                               raw_dtype=_worker_options["raw_dtype"])
+    self_id = next(entry["id"] for entry in _worker_schedule if str(entry["id"]) == node_id)
+    deltas = find_deltas(samples=samples,
+                         sampling_freq_hz=sampling_freq_hz,
+                         schedule=_worker_schedule,
+                         self_id=self_id,
+                         cache=_worker_cache,
+                         detector=_worker_detector)
+    _save_atomic(output_path, np.asarray(deltas, dtype=np.float64))
+    return node_id, len(samples), sampling_freq_hz
+
+
+def process_directory(schedule: List[Dict],
+                      recordings: Dict[str, str],
+                      output_dir: str,
+                      workers: int = None,
+                      sampling_freq_hz: float = None,
+                      raw_dtype: str = "float32",
+                      c: float = 343,
+                      cache_path: str = None,
+                      log=None) -> Dict[str, float]:
+    """
+    Runs find_deltas for every recording on a process pool and writes one deltas file per node.
+
+    Nodes whose deltas file already exists are skipped, so an interrupted run can be resumed by running it again. A
+    digest of the schedule, sampling_freq_hz and raw_dtype is kept in the output directory and previous results are
+    discarded when it changes, so a changed schedule is never mixed with results computed for another one. At
+    most two tasks per worker are in flight at once and workers memory-map their own recording, which keeps memory
+    bounded regardless of the number of recordings. If cache_path is given, workers share a DetectionCache stored
+    there so reprocessing the same recordings skips detection. Once every node has been processed the assembled
+    deltas matrix and distance matrix are written to the output directory in the pybeepbeep.wire format, with inf
+    rows for nodes without a recording.
+
+    Raises a ValueError before any recording is processed if sampling_freq_hz is missing but raw recordings need it.
+    """
+    if log is None:
+        log = sys.stdout
+    _check_sampling_freq_hz(recordings, sampling_freq_hz)
+
+    deltas_dir = os.path.join(output_dir, "deltas")
+    os.makedirs(deltas_dir, exist_ok=True)
+    _invalidate_stale_deltas(output_dir, deltas_dir, _run_digest(schedule, sampling_freq_hz, raw_dtype), log)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    pending = []
+    skipped = 0
+    for node_id, path in recordings.items():
+        output_path = os.path.join(deltas_dir, node_id + ".npy")
+        if os.path.exists(output_path):
+            skipped += 1
+        else:
+            pending.append((node_id, path, output_path))
+
+    processed = 0
+    failed = 0
+    n_samples = 0
+    audio_s = 0.0
+    start = time.perf_counter()
+
+    options = {"sampling_freq_hz": sampling_freq_hz, "raw_dtype": raw_dtype, "cache_path": cache_path}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(schedule, options)) as pool:
+        in_flight = {}
+        tasks = iter(pending)
+        while True:
+            while len(in_flight) < 2 * workers:
+                task = next(tasks, None)
+                if task is None:
+                    break
+                in_flight[pool.submit(_process_recording, *task)] = task[0]
+
+            if len(in_flight) == 0:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                node_id = in_flight.pop(future)
+                try:
+                    _, node_samples, node_sampling_freq_hz = future.result()
+                except Exception as e:
+                    failed += 1
+                    print("failed to process {}: {}".format(node_id, e), file=log)
+                    continue
+                processed += 1
+                n_samples += node_samples
+                audio_s += node_samples / node_sampling_freq_hz
+
+    elapsed_s = time.perf_counter() - start
+
+    deltas = np.full((len(schedule), len(schedule)), math.inf)
+    for i, entry in enumerate(schedule):
+        path = os.path.join(deltas_dir, str(entry["id"]) + ".npy")
+        if os.path.exists(path):
+            deltas[i] = np.load(path)
+
+    if sampling_freq_hz is None:
+        sampling_freq_hz = _round_sampling_freq_hz(recordings)
+
+    ids = [str(entry["id"]) for entry in schedule]
+    distances = calculate_distances(deltas, sampling_freq_hz, c=c)
+    _save_atomic(os.path.join(output_dir, "deltas.bin"), encode_deltas(deltas, ids))
+    _save_atomic(os.path.join(output_dir, "distances.bin"), encode_distances(distances, ids))
+
+    stats = {
+        "processed": processed,
+        "skipped": skipped,
+        "failed": failed,
+        "elapsed_s": elapsed_s,
+        "recordings_per_s": processed / elapsed_s if elapsed_s > 0 else 0.0,
+        "samples_per_s": n_samples / elapsed_s if elapsed_s > 0 else 0.0,
+        "realtime_factor": audio_s / elapsed_s if elapsed_s > 0 else 0.0,
+    }
+
+    print("processed {processed} recordings ({skipped} skipped, {failed} failed) in {elapsed_s:.2f} s: "
+          "{recordings_per_s:.2f} recordings/s, {samples_per_s:.0f} samples/s, "
+          "{realtime_factor:.1f}x realtime".format(**stats), file=log)
+
+    return stats
+
+
+def _round_sampling_freq_hz(recordings: Dict[str, str]) -> float:
+    # every node in a round records at the same rate, so any wav header will do
+    for path in recordings.values():
+        if path.lower().endswith(".wav"):
+            return load_recording(path)[1]
+    raise ValueError("A sampling rate is required when no WAV recordings are present")
+
+
+def _parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="pybeepbeep",
+                                     description="Batch process a directory of per-node recordings of a ranging "
+                                                 "round. Recordings are matched to schedule entries by file name, "
+                                                 "e.g. <id>.wav or <id>.raw.")
+    parser.add_argument("schedule", help="JSON or binary schedule as produced by generate_schedule")
+    parser.add_argument("recordings", help="directory of per-node WAV or raw recordings")
+    parser.add_argument("output", help="directory to write deltas and distances to")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("-r", "--sampling-rate", type=float, default=None,
+                        help="sampling rate of raw recordings in Hz")
+    parser.add_argument("--raw-dtype", default="float32", help="sample type of raw recordings")
+    parser.add_argument("-c", "--speed-of-sound", type=float, default=343, help="speed of sound in m/s")
+    parser.add_argument("--cache", default=None, help="path of a detection cache shared across runs")
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] = None) -> int:
+    args = _parse_args(argv)
+
+    schedule = load_schedule(args.schedule)
+    recordings = find_recordings(args.recordings, schedule)
+    if len(recordings) == 0:
+        print("no recordings found in {}".format(args.recordings), file=sys.stderr)
+        return 1
+    try:
+        _check_sampling_freq_hz(recordings, args.sampling_rate)
+    except ValueError as e:
+        print("{}, pass --sampling-rate".format(e), file=sys.stderr)
+        return 1
+
+    stats = process_directory(schedule=schedule,
+                              recordings=recordings,
+                              output_dir=args.output,
+                              workers=args.workers,
+                              sampling_freq_hz=args.sampling_rate,
+                              raw_dtype=args.raw_dtype,
+                              c=args.speed_of_sound,
+                              cache_path=args.cache)
+
+    return 0 if stats["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
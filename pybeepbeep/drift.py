@@ -0,0 +1,71 @@
+import math
+from typing import Dict, List
+
+import numpy as np
+
+from pybeepbeep.ranging import ClockModel, Detection
+
+
+class DriftEstimator:
+    """
+    Fits a recorder's ClockModel from the onsets of its own beeps.
+
+    A node hears its own beep with no propagation delay, so the sample at which its beeps are detected, plotted against
+    their scheduled times, is a line whose intercept is the recording's offset and whose slope is its actual sample
+    rate. Onsets can be added over any number of slots and rounds, only running sums are kept. Once fitted, the clock
+    keeps the windows of later rounds centered on the beeps of long continuous recordings.
+    """
+
+    def __init__(self, sampling_freq_hz: float):
+        self.sampling_freq_hz = sampling_freq_hz
+        self.count = 0
+        self._mean_time_s = 0.0
+        self._mean_onset = 0.0
+        self._time_variance = 0.0
+        self._covariance = 0.0
+
+    def add(self, time_s: float, onset: float):
+        """
+        Adds the sample index at which a beep scheduled at time_s was detected, missed beeps (None or inf) are ignored.
+        """
+        if onset is None or not math.isfinite(onset):
+            return
+
+        # Welford's update, the times and onsets of long recordings are too large for plain sums of squares
+        self.count += 1
+        time_delta = time_s - self._mean_time_s
+        self._mean_time_s += time_delta / self.count
+        self._mean_onset += (onset - self._mean_onset) / self.count
+        self._time_variance += time_delta * (time_s - self._mean_time_s)
+        self._covariance += time_delta * (onset - self._mean_onset)
+
+    def add_detections(self, detections: List[Detection], schedule: List[Dict], self_id: str):
+        """
+        Adds the self beeps among the detections returned by find_detections for the schedule.
+        """
+        for detection, entry in zip(detections, schedule):
+            if entry["id"] == self_id:
+                self.add(entry["time_s"], detection.onset)
+
+    @property
+    def clock(self) -> ClockModel:
+        if self.count == 0:
+            return ClockModel()
+
+        if self.count == 1 or self._time_variance == 0:
+            # a single time can only tell the offset
+            return ClockModel(offset_samples=self._mean_onset - self._mean_time_s * self.sampling_freq_hz)
+
+        rate = self._covariance / self._time_variance
+        return ClockModel(offset_samples=self._mean_onset - rate * self._mean_time_s,
+                          skew=rate / self.sampling_freq_hz - 1)
+
+
+def estimate_clock(times_s: np.ndarray, onsets: np.ndarray, sampling_freq_hz: float) -> ClockModel:
+    """
+    Fits a ClockModel to the onsets of beeps scheduled at times_s in one pass, see DriftEstimator.
+    """
+    estimator = DriftEstimator(sampling_freq_hz)
+    for time_s, onset in zip(times_s, onsets):
+        estimator.add(float(time_s), None if onset is None else float(onset))
+    return estimator.clock
@@ -0,0 +1,164 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from pybeepbeep.ranging import BeepDetector, _calculate_windows_for_schedule, _clip_window, time_to_samples
+
+
+# onset written to the shared result for windows without a beep
+_no_onset = -1
+
+# per worker process state, set once by _init_worker so tasks only carry block names and offsets
+_worker_detector = None
+_worker_options = None
+
+
+def _create(shape: Tuple[int, ...], dtype: np.dtype) -> Tuple[object, np.ndarray]:
+    # multiprocessing.shared_memory needs Python 3.8, only import it when parallel detection is used
+    from multiprocessing import shared_memory
+
+    dtype = np.dtype(dtype)
+    block = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def _attach(name: str, shape: Tuple[int, ...], dtype: np.dtype) -> Tuple[object, np.ndarray]:
+    from multiprocessing import shared_memory
+
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+
+
+def _init_worker(options: Dict):
+    global _worker_detector, _worker_options
+    _worker_detector = BeepDetector()
+    _worker_options = options
+
+
+def _detect_windows(block_name: str,
+                    n_samples: int,
+                    dtype: str,
+                    row: int,
+                    first_entry: int,
+                    windows: np.ndarray,
+                    schedule_slice: List[Dict]):
+    recording_block, recording = _attach(block_name, (n_samples,), dtype)
+    result_block, onsets = _attach(_worker_options["result_name"], _worker_options["result_shape"], np.int64)
+
+    try:
+        for k, (window, entry) in enumerate(zip(windows.tolist(), schedule_slice)):
+            start, stop = _clip_window(window, n_samples)
+            if stop == start:
+                # the window lies outside the recording, its onset stays _no_onset
+                continue
+            detection = _worker_detector.detect(samples=recording[start:stop],
+                                                sampling_freq_hz=_worker_options["sampling_freq_hz"],
+                                                target_signal_freq_hz=entry["target_hz"],
+                                                duration_ms=entry["duration_ms"],
+                                                block_size=_worker_options["block_size"],
+                                                min_snr_db=_worker_options["min_snr_db"])
+            onsets[row, first_entry + k] = _no_onset if detection.onset is None else start + detection.onset
+    finally:
+        # the views must be gone before the blocks can be closed
+        del recording, onsets
+        recording_block.close()
+        result_block.close()
+
+
+def find_all_onsets(recordings: Dict[str, np.ndarray],
+                    sampling_freq_hz: float,
+                    schedule: [{}],
+                    workers: int = None,
+                    entries_per_task: int = None,
+                    block_ms: float = None,
+                    min_snr_db: float = 20.0) -> np.ndarray:
+    """
+    Searches the window of every schedule entry in every recording on a process pool and returns an (n_recordings,
+    n_entries) array of onsets as sample indices into each recording, -1 where no beep was found.
+
+    Every recording is copied once into a shared memory block and the onsets are written by the workers straight into
+    a shared result array, so a task only carries a block name, window offsets and a slice of entries_per_task schedule
+    entries (the whole schedule by default). The cost of handing work to a worker therefore does not grow with the
+    length of the recordings. Each worker reuses one BeepDetector across its tasks. Requires Python 3.8 or later.
+    """
+    ids = list(recordings.keys())
+    n_entries = len(schedule)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if entries_per_task is None:
+        entries_per_task = max(n_entries, 1)
+
+    windows = np.array(_calculate_windows_for_schedule(sampling_freq_hz=sampling_freq_hz, schedule=schedule) or [],
+                       dtype=np.int64).reshape(-1, 2)
+    block_size = None if block_ms is None else int(time_to_samples(block_ms / 1000.0, sampling_freq_hz))
+
+    blocks = []
+    try:
+        result_block, onsets = _create((len(ids), n_entries), np.int64)
+        blocks.append(result_block)
+        onsets[...] = _no_onset
+
+        tasks = []
+        for row, node_id in enumerate(ids):
+            recording = np.asarray(recordings[node_id])
+            block, shared = _create(recording.shape, recording.dtype)
+            blocks.append(block)
+            shared[...] = recording
+
+            for first_entry in range(0, n_entries, entries_per_task):
+                last_entry = first_entry + entries_per_task
+                tasks.append((block.name, len(recording), recording.dtype.str, row, first_entry,
+                              windows[first_entry:last_entry], schedule[first_entry:last_entry]))
+
+        options = {
+            "sampling_freq_hz": sampling_freq_hz,
+            "block_size": block_size,
+            "min_snr_db": min_snr_db,
+            "result_name": result_block.name,
+            "result_shape": onsets.shape,
+        }
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(options,)) as pool:
+            for future in [pool.submit(_detect_windows, *task) for task in tasks]:
+                future.result()
+
+        return np.array(onsets)
+    finally:
+        # the views must be gone before the blocks can be closed
+        onsets = shared = None
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def find_all_deltas(recordings: Dict[str, np.ndarray],
+                    sampling_freq_hz: float,
+                    schedule: [{}],
+                    workers: int = None,
+                    entries_per_task: int = None,
+                    block_ms: float = None,
+                    min_snr_db: float = 20.0) -> np.ndarray:
+    """
+    Runs find_deltas for every recording, keyed by the id of the node that recorded it, on a process pool and returns
+    the deltas as an (n_recordings, n_entries) array in the order of recordings. Rows of nodes whose own beep was not
+    found are inf. See find_all_onsets for how the work is shared between processes.
+    """
+    onsets = find_all_onsets(recordings=recordings,
+                             sampling_freq_hz=sampling_freq_hz,
+                             schedule=schedule,
+                             workers=workers,
+                             entries_per_task=entries_per_task,
+                             block_ms=block_ms,
+                             min_snr_db=min_snr_db)
+
+    deltas = np.where(onsets == _no_onset, math.inf, onsets.astype(np.float64))
+    # as in find_deltas, a node's reference is the onset of its last beep in the schedule, 0 if it never beeps
+    self_index = {entry["id"]: i for i, entry in enumerate(schedule)}
+    for row, node_id in enumerate(recordings.keys()):
+        if node_id not in self_index:
+            continue
+        self_onset = deltas[row, self_index[node_id]]
+        deltas[row] = np.absolute(deltas[row] - self_onset) if math.isfinite(self_onset) else math.inf
+    return deltas
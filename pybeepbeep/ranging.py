@@ -1,17 +1,62 @@
 import math
-from typing import Callable, Dict, List
-
-from librosa.core import time_to_samples, tone
+import threading
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
 
 import numpy as np
 
-from scipy.signal import correlate, find_peaks, hilbert
+from pybeepbeep.backends import NumpyBackend, get_backend
 
 
 # set fft window size
 # this corresponds to a resolution of about 2% of the sampling frequency
 _fft_width = 512
 
+# bump whenever a change to BeepDetector can change its result, this invalidates cached detections
+_detector_version = 5
+
+# fraction of a perfect template match an onset found in a block needs before the block search stops there
+_min_block_match = .25
+
+# per thread BeepDetector used by find_detections and find_deltas when the caller does not pass one
+_default_detectors = threading.local()
+
+
+def tone(frequency: float, sr: float, duration: float) -> np.ndarray:
+    """
+    Pure tone of the given frequency and duration in seconds, numerically identical to librosa.tone.
+    """
+    return np.cos(2 * np.pi * frequency * np.arange(duration * sr) / sr - np.pi * 0.5)
+
+
+def time_to_samples(times, sr: float = 22050):
+    """
+    Converts times in seconds to sample indices, numerically identical to librosa.time_to_samples.
+    """
+    return (np.asanyarray(times) * sr).astype(int)
+
+
+def samples_to_time(samples, sr: float = 22050):
+    """
+    Converts sample indices to times in seconds, numerically identical to librosa.samples_to_time.
+    """
+    return np.asanyarray(samples) / float(sr)
+
+
+def _next_fast_len(n: int) -> int:
+    # smallest 5-smooth number >= n, these are the sizes pocketfft transforms fastest
+    best = 1 << max(n - 1, 0).bit_length()
+    power_of_5 = 1
+    while power_of_5 < best:
+        power_of_35 = power_of_5
+        while power_of_35 < best:
+            size = power_of_35
+            while size < n:
+                size *= 2
+            best = min(best, size)
+            power_of_35 *= 3
+        power_of_5 *= 5
+    return best
+
 
 def _get_window_size_ms(duration_ms: float):
     return 20 * duration_ms
@@ -22,80 +67,375 @@ def get_minimum_channel_width(sampling_freq_hz: float):
     return 10 * resolution
 
 
-def _find_beep_in_window(samples: np.ndarray,
-                         sampling_freq_hz: float,
-                         target_signal_freq_hz: float,
-                         duration_ms: float) -> int:
-    if target_signal_freq_hz >= sampling_freq_hz / 2:
-        raise Exception(
-            "Sampling frequency must be > 2x the target frequency. See https://en.wikipedia.org/wiki/Nyquist_rate"
-        )
+class Detection(NamedTuple):
+    """
+    A beep search result. onset is the sample index of the beep in the searched window, or None if no beep was found.
+    peak_ratio is the envelope at the onset over the detection threshold and snr_db compares the envelope at the onset
+    to the median of the envelope, which approximates the noise floor.
+    """
+    onset: Optional[int]
+    peak_ratio: float
+    snr_db: float
 
-    # generate target signal
-    signal = tone(target_signal_freq_hz, sampling_freq_hz, duration=duration_ms/1000.0)
 
-    # find onset, this differs from the description in the paper which uses a sharpness and peak finding algorithm
-    correlation = correlate(samples, signal, mode='valid', method='fft')
-    envelope = np.abs(hilbert(correlation))
-    max_correlation = np.max(correlation)
-    peaks, _ = find_peaks(envelope)
-    filtered_peaks = peaks[(peaks < len(samples)).nonzero()]
-    peaks = peaks[(envelope[filtered_peaks] > .85 * max_correlation).nonzero()]
+class ClockModel(NamedTuple):
+    """
+    Maps schedule time to a recording's sample index, sample = offset_samples + time_s * sampling_freq_hz * (1 + skew),
+    where skew is the relative error of the recorder's sample rate. See pybeepbeep.drift for estimating it.
+    """
+    offset_samples: float = 0.0
+    skew: float = 0.0
 
-    ratio = (np.max(signal) / np.max(correlation))
+    def to_samples(self, times_s, sampling_freq_hz: float):
+        return (self.offset_samples + np.asanyarray(times_s) * sampling_freq_hz * (1 + self.skew)).astype(int)
 
-    correlation *= ratio
-    envelope *= ratio
 
-    if len(peaks) == 0:
-        # if not found, use None
-        return None
-    else:
-        return peaks[0]
+class BeepDetector:
+    """
+    Finds beeps in windows of samples while reusing its working memory between calls.
+
+    Templates, template spectra and the scratch buffers for the correlation and its envelope are allocated once per
+    window size and kept, so once every window size of a schedule has been seen, detection runs the FFTs into
+    preallocated buffers. Reusing one detector across windows and rounds avoids reallocating these for every window.
+    A detector is not thread safe, use one per thread or process.
+
+    The kernels run on the given backend from pybeepbeep.backends, or on the backend selected at the time of each call.
+    """
+
+    def __init__(self, backend: NumpyBackend = None):
+        self.backend = backend
+        self._templates = {}
+        self._spectra = {}
+        self._hilbert_weights = {}
+        self._buffers = {}
+
+    def _buffer(self, name: str, size: int, dtype: type) -> np.ndarray:
+        key = (name, size, dtype)
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            buffer = np.empty(size, dtype=dtype)
+            self._buffers[key] = buffer
+        return buffer
+
+    def _template(self, sampling_freq_hz: float, target_signal_freq_hz: float, duration_ms: float) -> np.ndarray:
+        key = (sampling_freq_hz, target_signal_freq_hz, duration_ms)
+        template = self._templates.get(key)
+        if template is None:
+            template = tone(target_signal_freq_hz, sampling_freq_hz, duration=duration_ms/1000.0)
+            self._templates[key] = template
+        return template
+
+    def _quadrature(self, sampling_freq_hz: float, target_signal_freq_hz: float, duration_ms: float) -> np.ndarray:
+        # the template shifted by a quarter period, together they match a tone of any phase
+        key = (sampling_freq_hz, target_signal_freq_hz, duration_ms, "quadrature")
+        quadrature = self._templates.get(key)
+        if quadrature is None:
+            n = len(self._template(sampling_freq_hz, target_signal_freq_hz, duration_ms))
+            quadrature = np.cos(2 * np.pi * target_signal_freq_hz * np.arange(n) / sampling_freq_hz)
+            self._templates[key] = quadrature
+        return quadrature
+
+    def _match(self, samples: np.ndarray, onset: int, template_key: tuple) -> float:
+        """
+        How well the samples starting at onset match the template, from 0 for an orthogonal signal to 1 for a scaled
+        copy of the tone in any phase. Unlike the detection threshold this does not depend on the rest of the window.
+        """
+        segment = samples[onset:onset + len(self._template(*template_key))]
+        signal = self._template(*template_key)[:len(segment)]
+        quadrature = self._quadrature(*template_key)[:len(segment)]
+        norm = math.sqrt(np.dot(segment, segment) * np.dot(signal, signal))
+        if norm == 0:
+            return 0.0
+        return math.hypot(np.dot(segment, signal), np.dot(segment, quadrature)) / norm
+
+    def _template_spectrum(self, template: np.ndarray, template_key: tuple, n_fft: int) -> np.ndarray:
+        key = template_key + (n_fft,)
+        spectrum = self._spectra.get(key)
+        if spectrum is None:
+            # correlating with the template is convolving with its time reverse, i.e. multiplying by the conjugate
+            spectrum = np.conj(np.fft.rfft(template, n_fft))
+            self._spectra[key] = spectrum
+        return spectrum
+
+    def _hilbert_weight(self, n: int) -> np.ndarray:
+        # weights turning the one sided spectrum of a real signal into the spectrum of its analytic signal, as in
+        # scipy.signal.hilbert
+        weight = self._hilbert_weights.get(n)
+        if weight is None:
+            weight = np.full(n // 2 + 1, 2.0)
+            weight[0] = 1.0
+            if n % 2 == 0:
+                weight[-1] = 1.0
+            self._hilbert_weights[n] = weight
+        return weight
+
+    def _backend(self) -> NumpyBackend:
+        return get_backend() if self.backend is None else self.backend
+
+    def _correlate(self, samples: np.ndarray, template: np.ndarray, template_key: tuple) -> np.ndarray:
+        n_valid = len(samples) - len(template) + 1
+        n_fft = _next_fast_len(len(samples))
+
+        padded = self._buffer("padded", n_fft, np.float64)
+        padded[:len(samples)] = samples
+        padded[len(samples):] = 0
+
+        spectrum = self._buffer("spectrum", n_fft // 2 + 1, np.complex128)
+        self._backend().fft_correlate(padded, self._template_spectrum(template, template_key, n_fft), spectrum)
+
+        # every lag below n_valid only overlaps real samples, so the circular correlation equals the 'valid' one there
+        return padded[:n_valid]
+
+    def _envelope(self, correlation: np.ndarray) -> np.ndarray:
+        n = len(correlation)
+        return self._backend().envelope(correlation,
+                                        self._hilbert_weight(n),
+                                        self._buffer("analytic", n, np.complex128),
+                                        self._buffer("envelope", n, np.float64))
+
+    def _noise_floor(self, envelope: np.ndarray) -> float:
+        # median of the envelope, partitioned in a scratch copy so the envelope keeps its order
+        floor = self._buffer("floor", len(envelope), np.float64)
+        floor[:] = envelope
+        middle = len(floor) // 2
+        floor.partition(middle)
+        return floor[middle]
+
+    def _search(self, samples: np.ndarray, signal: np.ndarray, template_key: tuple, skip: int = 0) -> Detection:
+        if len(samples) < len(signal):
+            # windows shorter than the beep, e.g. clipped at the end of a recording, are correlated with scipy instead
+            # of the backend, whose buffers and template spectra assume the window holds the whole template.
+            # scipy.signal is slow to import, so only load it when it is needed
+            from scipy.signal import correlate, hilbert
+
+            # scipy swaps the inputs of a 'valid' correlation when the window is shorter than the template
+            correlation = correlate(samples, signal, mode='valid', method='fft')
+            envelope = np.abs(hilbert(correlation))
+        else:
+            correlation = self._correlate(samples, signal, template_key)
+            envelope = self._envelope(correlation)
+
+        # find onset, this differs from the description in the paper which uses a sharpness and peak finding algorithm
+        threshold = .85 * np.max(correlation)
+        if skip > 0:
+            # peaks before skip are ignored, starting one sample early so a peak at skip still has its left neighbour
+            onset = self._backend().first_peak_above(envelope[skip - 1:], threshold, self._buffer)
+            onset = onset + skip - 1 if onset >= 0 else onset
+        else:
+            onset = self._backend().first_peak_above(envelope, threshold, self._buffer)
+
+        if onset < 0:
+            # if not found, use None
+            return Detection(onset=None, peak_ratio=0.0, snr_db=-math.inf)
+
+        peak = envelope[onset]
+        floor = self._noise_floor(envelope)
+        with np.errstate(divide='ignore'):
+            snr_db = 20 * np.log10(peak / floor) if floor > 0 else math.inf
+        return Detection(onset=onset, peak_ratio=float(peak / threshold), snr_db=float(snr_db))
+
+    def detect(self,
+               samples: np.ndarray,
+               sampling_freq_hz: float,
+               target_signal_freq_hz: float,
+               duration_ms: float,
+               block_size: int = None,
+               min_snr_db: float = 20.0) -> Detection:
+        """
+        Finds the first beep in samples and reports how confident the detection is.
+
+        If block_size is given, the window is searched block_size correlation lags at a time in time order and the
+        search stops at the first onset with an SNR of at least min_snr_db whose samples match the template, so the
+        rest of the window is never correlated. A block's threshold and SNR are relative to the block alone, so any
+        energy, e.g. a louder beep on a neighbouring channel, can look confident there. The onset must therefore also
+        match at least a quarter as well as a clean copy of the tone would. Each block also correlates one template
+        length before and after its lags, so a beep starting near either edge of a block is seen whole, and only
+        onsets within the block's own lags are accepted. Blocks shorter than the template therefore correlate more
+        samples in total than the whole window does. If no block has a confident onset the whole window is searched
+        again as without blocks, so windows without a confident beep cost more than without blocks.
+        """
+        if target_signal_freq_hz >= sampling_freq_hz / 2:
+            raise Exception(
+                "Sampling frequency must be > 2x the target frequency. See https://en.wikipedia.org/wiki/Nyquist_rate"
+            )
+
+        # generate target signal
+        template_key = (sampling_freq_hz, target_signal_freq_hz, duration_ms)
+        signal = self._template(*template_key)
+
+        n_valid = len(samples) - len(signal) + 1
+        if block_size is not None and 0 < block_size < n_valid:
+            for start in range(0, n_valid, block_size):
+                stop = min(start + block_size, n_valid)
+                # correlating from one template length before the block keeps the envelope's edge artifact, and the
+                # rising correlation of a beep starting just after start, away from the lags the block accepts
+                begin = max(start - len(signal), 0)
+                end = min(stop + len(signal), n_valid) + len(signal) - 1
+                detection = self._search(samples[begin:end], signal, template_key, skip=start - begin)
+                if (detection.onset is not None
+                        and detection.onset < stop - begin
+                        and detection.snr_db >= min_snr_db
+                        and self._match(samples, begin + detection.onset, template_key) >= _min_block_match):
+                    return detection._replace(onset=detection.onset + begin)
+
+        return self._search(samples, signal, template_key)
+
+    def find_beep(self,
+                  samples: np.ndarray,
+                  sampling_freq_hz: float,
+                  target_signal_freq_hz: float,
+                  duration_ms: float) -> int:
+        return self.detect(samples=samples,
+                           sampling_freq_hz=sampling_freq_hz,
+                           target_signal_freq_hz=target_signal_freq_hz,
+                           duration_ms=duration_ms).onset
+
+
+def _default_detector() -> BeepDetector:
+    detector = getattr(_default_detectors, "detector", None)
+    if detector is None:
+        detector = BeepDetector()
+        _default_detectors.detector = detector
+    return detector
+
+
+def _find_beep_in_window(samples: np.ndarray,
+                         sampling_freq_hz: float,
+                         target_signal_freq_hz: float,
+                         duration_ms: float) -> int:
+    return _default_detector().find_beep(samples=samples,
+                                         sampling_freq_hz=sampling_freq_hz,
+                                         target_signal_freq_hz=target_signal_freq_hz,
+                                         duration_ms=duration_ms)
 
 
 def _calculate_windows_for_schedule(sampling_freq_hz: float,
-                                    schedule: [{}]) -> [(int, int)]:
+                                    schedule: [{}],
+                                    clock: ClockModel = None) -> [(int, int)]:
     if len(schedule) == 0:
         return None
 
     window_duration_s = _get_window_size_ms(schedule[0]["duration_ms"]) / 1000.0
     half_window_s = window_duration_s / 2
 
+    # without a clock model the recording is assumed to start at time 0 and run at exactly the nominal rate
+    to_samples = time_to_samples if clock is None else clock.to_samples
+
     return [
         (
-            time_to_samples(entry["time_s"] - half_window_s, sampling_freq_hz),
-            time_to_samples(entry["time_s"] + half_window_s, sampling_freq_hz)
+            to_samples(entry["time_s"] - half_window_s, sampling_freq_hz),
+            to_samples(entry["time_s"] + half_window_s, sampling_freq_hz)
         )
         for entry in schedule
     ]
 
 
+def _clip_window(window: Tuple[int, int], n_samples: int) -> Tuple[int, int]:
+    # a clock can place windows partly or wholly outside the recording, e.g. when the capture started after time 0
+    start = min(max(int(window[0]), 0), n_samples)
+    return start, min(max(int(window[1]), start), n_samples)
+
+
+def find_detections(samples: np.ndarray,
+                    sampling_freq_hz: float,
+                    schedule: [{}],
+                    cache=None,
+                    detector: BeepDetector = None,
+                    block_ms: float = None,
+                    min_snr_db: float = 20.0,
+                    clock: ClockModel = None) -> List[Detection]:
+    """
+    Searches the window of every schedule entry and returns one Detection per entry, with onsets as sample indices
+    into samples. Low confidence detections can be used to pick pairs to range again.
+
+    If a DetectionCache is given, windows that have already been searched with the same parameters are looked up
+    instead of being searched again. Without a detector the calling thread's default BeepDetector is used, so its
+    templates and buffers are reused across calls and rounds. These stay allocated for the lifetime of the thread,
+    pass a BeepDetector to control that.
+    block_ms enables the early exit search of BeepDetector.detect with blocks of that duration. A ClockModel places
+    the windows where the recorder's clock actually recorded the scheduled times.
+    """
+    if detector is None:
+        detector = _default_detector()
+
+    block_size = None if block_ms is None else int(time_to_samples(block_ms / 1000.0, sampling_freq_hz))
+
+    windows = _calculate_windows_for_schedule(sampling_freq_hz=sampling_freq_hz,
+                                              schedule=schedule,
+                                              clock=clock)
+    detections = []
+
+    for i, window in enumerate(windows):
+        start, stop = _clip_window(window, len(samples))
+        window_samples = samples[start:stop]
+        found = False
+
+        if len(window_samples) == 0:
+            detections.append(Detection(onset=None, peak_ratio=0.0, snr_db=-math.inf))
+            continue
+
+        if cache is not None:
+            key = cache.key(samples=window_samples,
+                            sampling_freq_hz=sampling_freq_hz,
+                            target_signal_freq_hz=schedule[i]["target_hz"],
+                            duration_ms=schedule[i]["duration_ms"],
+                            block_size=block_size,
+                            min_snr_db=min_snr_db)
+            found, detection = cache.get(key)
+
+        if not found:
+            detection = detector.detect(samples=window_samples,
+                                        sampling_freq_hz=sampling_freq_hz,
+                                        target_signal_freq_hz=schedule[i]["target_hz"],
+                                        duration_ms=schedule[i]["duration_ms"],
+                                        block_size=block_size,
+                                        min_snr_db=min_snr_db)
+            if cache is not None:
+                cache.put(key, detection)
+
+        if detection.onset is not None:
+            detection = detection._replace(onset=detection.onset + start)
+        detections.append(detection)
+
+    return detections
+
+
 def find_deltas(samples: np.ndarray,
                 sampling_freq_hz: float,
                 schedule: [{}],
-                self_id: str) -> [float]:
-    windows = _calculate_windows_for_schedule(sampling_freq_hz=sampling_freq_hz,
-                                              schedule=schedule)
+                self_id: str,
+                cache=None,
+                detector: BeepDetector = None,
+                block_ms: float = None,
+                min_snr_db: float = 20.0,
+                clock: ClockModel = None) -> [float]:
+    """
+    See find_detections for the optional arguments. With a ClockModel the deltas are corrected for the recorder's skew
+    so they are counted in samples of the nominal sampling frequency.
+    """
+    detections = find_detections(samples=samples,
+                                 sampling_freq_hz=sampling_freq_hz,
+                                 schedule=schedule,
+                                 cache=cache,
+                                 detector=detector,
+                                 block_ms=block_ms,
+                                 min_snr_db=min_snr_db,
+                                 clock=clock)
     onsets = np.zeros(len(schedule))
     self_n = 0
 
-    for i, window in enumerate(windows):
-        n_onset = _find_beep_in_window(samples=samples[window[0]:window[1]],
-                                       sampling_freq_hz=sampling_freq_hz,
-                                       target_signal_freq_hz=schedule[i]["target_hz"],
-                                       duration_ms=schedule[i]["duration_ms"])
-
-        if n_onset is None:
+    for i, detection in enumerate(detections):
+        if detection.onset is None:
             onsets[i] = math.inf
         else:
-            n_onset += window[0]
-            onsets[i] = float(n_onset)
+            onsets[i] = float(detection.onset)
 
         if schedule[i]["id"] == self_id:
-            self_n = n_onset
+            self_n = detection.onset
 
-    return np.absolute(onsets - self_n)
+    if clock is None:
+        return np.absolute(onsets - self_n)
+    return np.absolute(onsets - self_n) / (1 + clock.skew)
 
 
 def single_tone_scheduler(nodes: [str],
@@ -124,6 +464,13 @@ def band_scheduler(nodes: [str],
     return schedule
 
 
+def shift_schedule(schedule: [{}], offset_s: float) -> [{}]:
+    """
+    Returns a copy of the schedule moved offset_s later, e.g. to describe later rounds of a continuous recording.
+    """
+    return [dict(entry, time_s=entry["time_s"] + offset_s) for entry in schedule]
+
+
 def generate_schedule(nodes: [str],
                       schedule_strategy: Callable[[List[str], List[float], float], List[Dict]] = single_tone_scheduler,
                       scheduler_kwargs: {} = None) -> [{}]:
@@ -158,13 +505,7 @@ def calculate_distances(deltas: np.ndarray, sampling_freq_hz: float, c: float =
     """
     conversion_factor = c / (2 * sampling_freq_hz)
 
-    deltas_t = deltas.T
-
-    k1 = deltas * np.eye(deltas.shape[0]) @ np.ones(deltas.shape)
-    k2 = k1.T
-    k = k1 + k2
-
-    return conversion_factor * (np.abs(deltas - deltas_t) + k)
+    return get_backend().distances(deltas, conversion_factor)
 
 
 def index_distances(distances: np.ndarray, schedule: List[Dict]) -> Dict[str, Dict]:
@@ -0,0 +1,131 @@
+import math
+from typing import Dict, List, NamedTuple, Sequence, Union
+
+import numpy as np
+
+from pybeepbeep.ranging import _get_window_size_ms, get_minimum_channel_width
+
+
+class ScheduleArrays(NamedTuple):
+    """
+    A schedule held as one array per key rather than one dict per entry, entry i being the beep of ids[i] on
+    target_hz[i] at time_s[i].
+    """
+    ids: List[str]
+    target_hz: np.ndarray
+    duration_ms: np.ndarray
+    time_s: np.ndarray
+
+    @classmethod
+    def from_schedule(cls, schedule: List[Dict]) -> "ScheduleArrays":
+        return cls(ids=[entry["id"] for entry in schedule],
+                   target_hz=np.array([entry["target_hz"] for entry in schedule], dtype=np.float64),
+                   duration_ms=np.array([entry["duration_ms"] for entry in schedule], dtype=np.float64),
+                   time_s=np.array([entry["time_s"] for entry in schedule], dtype=np.float64))
+
+    def to_schedule(self) -> List[Dict]:
+        """
+        Returns the schedule as the list of dicts taken by find_deltas and the other ranging functions.
+        """
+        return [{"id": node, "target_hz": target_hz, "duration_ms": duration_ms, "time_s": time_s}
+                for node, target_hz, duration_ms, time_s in zip(self.ids,
+                                                                self.target_hz.tolist(),
+                                                                self.duration_ms.tolist(),
+                                                                self.time_s.tolist())]
+
+
+class ScheduleReport(NamedTuple):
+    """
+    round_duration_s is the time from the start of the recording to the end of the last window. channels_hz are the
+    distinct channels in increasing order and channel_load the number of beeps scheduled on each of them.
+    """
+    round_duration_s: float
+    channels_hz: np.ndarray
+    channel_load: np.ndarray
+
+
+def build_band_schedule(nodes: Sequence[str],
+                        channels: Sequence[float],
+                        duration_ms: float,
+                        sampling_freq_hz: float = None) -> ScheduleArrays:
+    """
+    Assigns nodes to channels and slots the same way as band_scheduler, i.e. the first ceil(len(nodes) /
+    len(channels)) nodes beep one window apart on the first channel and so on, but computes every assignment at once.
+    If sampling_freq_hz is given the schedule is checked with validate_schedule before it is returned.
+    """
+    n_nodes = len(nodes)
+    channels = np.asarray(channels, dtype=np.float64)
+    if len(channels) == 0:
+        raise ValueError("At least one channel is required")
+
+    window = _get_window_size_ms(duration_ms) / 1000.0
+    n_windows = max(math.ceil(n_nodes / float(len(channels))), 1)
+    index = np.arange(n_nodes)
+
+    arrays = ScheduleArrays(ids=list(nodes),
+                            target_hz=channels[index // n_windows],
+                            duration_ms=np.full(n_nodes, duration_ms, dtype=np.float64),
+                            time_s=(index % n_windows) * window + window)
+
+    if sampling_freq_hz is not None:
+        validate_schedule(arrays, sampling_freq_hz)
+
+    return arrays
+
+
+def validate_schedule(schedule: Union[List[Dict], ScheduleArrays], sampling_freq_hz: float) -> ScheduleReport:
+    """
+    Checks up front that every beep of a schedule can be detected at the given sampling frequency, rather than finding
+    out from failed detections, and reports the round's duration and load per channel.
+
+    Raises a ValueError if a channel is not below the Nyquist frequency, if two channels are closer than
+    get_minimum_channel_width, if entries have different durations (find_detections sizes every window from the first
+    entry), if a window starts before the recording or if two beeps on the same channel are less than a window apart,
+    so that one would fall in the other's window. Runs in O(N log N) for N entries.
+    """
+    if not isinstance(schedule, ScheduleArrays):
+        schedule = ScheduleArrays.from_schedule(schedule)
+
+    if len(schedule.ids) == 0:
+        return ScheduleReport(round_duration_s=0.0,
+                              channels_hz=np.zeros(0),
+                              channel_load=np.zeros(0, dtype=np.int64))
+
+    channels_hz, channel_index, channel_load = np.unique(schedule.target_hz, return_inverse=True, return_counts=True)
+
+    nyquist_hz = sampling_freq_hz / 2
+    if channels_hz[-1] >= nyquist_hz:
+        raise ValueError("Channels {} Hz are not below the Nyquist frequency of {} Hz".format(
+            ", ".join(map(str, channels_hz[channels_hz >= nyquist_hz].tolist())), nyquist_hz))
+
+    minimum_width_hz = get_minimum_channel_width(sampling_freq_hz)
+    too_close = np.nonzero(np.diff(channels_hz) < minimum_width_hz)[0]
+    if len(too_close) > 0:
+        first = too_close[0]
+        raise ValueError("Channels {} Hz and {} Hz are closer than the minimum channel width of {} Hz".format(
+            channels_hz[first], channels_hz[first + 1], minimum_width_hz))
+
+    if np.any(schedule.duration_ms != schedule.duration_ms[0]):
+        raise ValueError("All entries must have the same duration_ms")
+
+    window = _get_window_size_ms(schedule.duration_ms[0]) / 1000.0
+    # times built as slot * window + window can be a rounding error short of a whole window apart
+    tolerance = window * 1e-9
+
+    early = np.nonzero(schedule.time_s - window / 2 < -tolerance)[0]
+    if len(early) > 0:
+        raise ValueError("The window of {} at {} s starts before the recording".format(
+            schedule.ids[early[0]], schedule.time_s[early[0]]))
+
+    order = np.lexsort((schedule.time_s, channel_index))
+    gaps = np.diff(schedule.time_s[order])
+    same_channel = np.diff(channel_index[order]) == 0
+    overlapping = np.nonzero(same_channel & (gaps < window - tolerance))[0]
+    if len(overlapping) > 0:
+        first, second = order[overlapping[0]], order[overlapping[0] + 1]
+        raise ValueError("{} and {} beep on {} Hz {} s apart, less than a window of {} s".format(
+            schedule.ids[first], schedule.ids[second], schedule.target_hz[first], gaps[overlapping[0]], window))
+
+    return ScheduleReport(round_duration_s=float(np.max(schedule.time_s) + window / 2),
+                          channels_hz=channels_hz,
+                          channel_load=channel_load)
@@ -0,0 +1,202 @@
+from typing import Dict, Iterator, List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+from pybeepbeep.ranging import _get_window_size_ms, tone
+
+
+class SimulatedRound(NamedTuple):
+    ids: List[str]
+    recordings: np.ndarray
+    distances: np.ndarray
+
+
+def pairwise_distances(positions: np.ndarray) -> np.ndarray:
+    """
+    Euclidean distance between every pair of rows in an (n_nodes, n_dims) position array.
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    if positions.ndim == 1:
+        positions = positions[:, np.newaxis]
+
+    diff = positions[:, np.newaxis, :] - positions[np.newaxis, :, :]
+    return np.sqrt(np.einsum('ijk,ijk->ij', diff, diff))
+
+
+def _node_ids(schedule: List[Dict]) -> List[str]:
+    # every node records once, even if it beeps in several slots
+    return list(dict.fromkeys(entry["id"] for entry in schedule))
+
+
+def _node_positions(ids: List[str], positions: Dict[str, Sequence[float]]) -> np.ndarray:
+    missing = [node for node in ids if node not in positions]
+    if len(missing) > 0:
+        raise ValueError("No position given for nodes: {}".format(", ".join(map(str, missing))))
+
+    return np.array([positions[node] for node in ids], dtype=np.float64)
+
+
+def _templates(schedule: List[Dict], sampling_freq_hz: float) -> Tuple[List[np.ndarray], np.ndarray]:
+    # one hamming windowed tone per distinct (target_hz, duration_ms) pair, shared by every receiver
+    keys = [(entry["target_hz"], entry["duration_ms"]) for entry in schedule]
+    unique_keys = sorted(set(keys))
+    lookup = {key: i for i, key in enumerate(unique_keys)}
+
+    templates = []
+    for target_hz, duration_ms in unique_keys:
+        signal = tone(target_hz, sr=sampling_freq_hz, duration=duration_ms / 1000.0)
+        templates.append(signal * np.hamming(len(signal)))
+
+    return templates, np.array([lookup[key] for key in keys], dtype=np.intp)
+
+
+def _per_node(ids: List[str], values: Dict[str, float]) -> np.ndarray:
+    if values is None:
+        return np.zeros(len(ids))
+    return np.array([values.get(node, 0.0) for node in ids], dtype=np.float64)
+
+
+def _default_duration_s(schedule: List[Dict],
+                        distances: np.ndarray,
+                        offsets: np.ndarray,
+                        skews: np.ndarray,
+                        c: float) -> float:
+    window_s = _get_window_size_ms(max(entry["duration_ms"] for entry in schedule)) / 1000.0
+    last_s = max(entry["time_s"] for entry in schedule)
+    return (last_s + window_s + np.max(distances) / c + max(np.max(offsets), 0.0)) * (1 + max(np.max(skews), 0.0))
+
+
+def _mix(recording: np.ndarray, template: np.ndarray, starts: np.ndarray, gains: np.ndarray):
+    idx = starts[:, np.newaxis] + np.arange(len(template))
+    values = gains[:, np.newaxis] * template
+
+    if starts[0] < 0 or starts[-1] + len(template) > len(recording):
+        in_range = (idx >= 0) & (idx < len(recording))
+        idx = idx[in_range]
+        values = values[in_range]
+
+    # fancy assignment drops repeated indices, only fall back to the unbuffered add when arrivals overlap
+    if len(starts) > 1 and np.min(np.diff(starts)) < len(template):
+        np.add.at(recording, idx, values)
+    else:
+        recording[idx] += values
+
+
+def iter_recordings(positions: Dict[str, Sequence[float]],
+                    schedule: List[Dict],
+                    sampling_freq_hz: float,
+                    c: float = 343,
+                    duration_s: float = None,
+                    noise_std: float = 0.0,
+                    clock_offsets_s: Dict[str, float] = None,
+                    clock_skews: Dict[str, float] = None,
+                    reference_distance_m: float = 1.0,
+                    dtype: np.dtype = np.float64,
+                    seed: int = None) -> Iterator[Tuple[str, np.ndarray]]:
+    """
+    Yields (id, recording) for every node in the schedule, in order of first appearance, one recording at a time.
+
+    Every scheduled beep is emitted at its time_s. Every node records every beep delayed by the propagation time and
+    attenuated by spherical spreading relative to reference_distance_m (None disables attenuation). A node's clock
+    maps time t to sample (t + offset) * sampling_freq_hz * (1 + skew), with offsets in clock_offsets_s and relative
+    sample rate errors in clock_skews. White gaussian noise with standard deviation noise_std is added on top.
+    Recordings for the same seed are identical whether they are streamed or generated with simulate_round.
+    """
+    if len(schedule) == 0:
+        return
+
+    ids = _node_ids(schedule)
+    distances = pairwise_distances(_node_positions(ids, positions))
+    offsets = _per_node(ids, clock_offsets_s)
+    skews = _per_node(ids, clock_skews)
+    if duration_s is None:
+        duration_s = _default_duration_s(schedule, distances, offsets, skews, c)
+
+    n_samples = int(duration_s * sampling_freq_hz)
+    lookup = {node: i for i, node in enumerate(ids)}
+    emitters = np.array([lookup[entry["id"]] for entry in schedule], dtype=np.intp)
+    times = np.array([entry["time_s"] for entry in schedule], dtype=np.float64)
+    templates, template_index = _templates(schedule, sampling_freq_hz)
+    groups = [np.nonzero(template_index == i)[0] for i in range(len(templates))]
+
+    if reference_distance_m is None:
+        gains = np.ones(distances.shape)
+    else:
+        gains = reference_distance_m / np.maximum(distances, reference_distance_m)
+
+    seeds = np.random.SeedSequence(seed).spawn(len(ids))
+
+    for receiver, node in enumerate(ids):
+        recording = np.zeros(n_samples, dtype=dtype)
+        if noise_std > 0:
+            np.random.default_rng(seeds[receiver]).standard_normal(out=recording, dtype=recording.dtype)
+            recording *= noise_std
+
+        arrival_s = times + distances[receiver][emitters] / c + offsets[receiver]
+        arrivals = np.rint(arrival_s * sampling_freq_hz * (1 + skews[receiver])).astype(np.intp)
+        receiver_gains = gains[receiver][emitters]
+
+        for template, group in zip(templates, groups):
+            order = group[np.argsort(arrivals[group], kind='stable')]
+            _mix(recording, template.astype(dtype, copy=False), arrivals[order], receiver_gains[order])
+
+        yield node, recording
+
+
+def simulate_round(positions: Dict[str, Sequence[float]],
+                   schedule: List[Dict],
+                   sampling_freq_hz: float,
+                   c: float = 343,
+                   duration_s: float = None,
+                   noise_std: float = 0.0,
+                   clock_offsets_s: Dict[str, float] = None,
+                   clock_skews: Dict[str, float] = None,
+                   reference_distance_m: float = 1.0,
+                   dtype: np.dtype = np.float64,
+                   seed: int = None,
+                   mmap_path: str = None) -> SimulatedRound:
+    """
+    Simulates the recordings of the nodes in the schedule, see iter_recordings for the propagation model.
+
+    The schedule can span several rounds, in which case every node records all of them. Returns the (n_nodes,
+    n_samples) recordings in order of first appearance in the schedule along with the ground truth distance matrix, in
+    meters, that calculate_distances should reproduce. If mmap_path is given the recordings are written to a .npy file
+    at that path and returned memory-mapped, so rounds larger than memory can be generated.
+    """
+    ids = _node_ids(schedule)
+    if len(schedule) == 0:
+        return SimulatedRound(ids=ids, recordings=np.zeros((0, 0), dtype=dtype), distances=np.zeros((0, 0)))
+
+    distances = pairwise_distances(_node_positions(ids, positions))
+    if duration_s is None:
+        duration_s = _default_duration_s(schedule,
+                                         distances,
+                                         _per_node(ids, clock_offsets_s),
+                                         _per_node(ids, clock_skews),
+                                         c)
+
+    shape = (len(ids), int(duration_s * sampling_freq_hz))
+    if mmap_path is None:
+        recordings = np.empty(shape, dtype=dtype)
+    else:
+        recordings = np.lib.format.open_memmap(mmap_path, mode='w+', dtype=dtype, shape=shape)
+
+    stream = iter_recordings(positions=positions,
+                             schedule=schedule,
+                             sampling_freq_hz=sampling_freq_hz,
+                             c=c,
+                             duration_s=duration_s,
+                             noise_std=noise_std,
+                             clock_offsets_s=clock_offsets_s,
+                             clock_skews=clock_skews,
+                             reference_distance_m=reference_distance_m,
+                             dtype=dtype,
+                             seed=seed)
+
+    for i, (_, recording) in enumerate(stream):
+        recordings[i] = recording
+
+    if mmap_path is not None:
+        recordings.flush()
+
+    return SimulatedRound(ids=ids, recordings=recordings, distances=distances)
@@ -0,0 +1,277 @@
+"""
+Compact binary encoding of schedules, onset/delta rows and distance matrices.
+
+Every message starts with an 8 byte header: the magic b"BEEP", a format version, a message kind and two reserved
+bytes. All numbers are little-endian and every array starts on an 8 byte boundary so it can be decoded with
+np.frombuffer without copying. Node ids are stored once per message in an id table of utf-8 strings, flagging the ids
+that were ints so they decode back to ints.
+"""
+import struct
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+
+_magic = b"BEEP"
+_version = 2
+
+_kind_schedule = 1
+_kind_deltas = 2
+_kind_distances = 3
+
+_header = struct.Struct("<4sBBxx")
+
+_column_table = 0
+_column_slots = 1
+
+_index_dtypes = [np.dtype("<u1"), np.dtype("<u2"), np.dtype("<u4")]
+_slot_dtypes = [np.dtype("<i1"), np.dtype("<i2"), np.dtype("<i4")]
+_value_dtypes = [np.dtype("<f4"), np.dtype("<f8")]
+
+_schedule_keys = ("id", "target_hz", "duration_ms", "time_s")
+
+
+class _Writer:
+    def __init__(self, kind: int):
+        self._buffer = bytearray(_header.pack(_magic, _version, kind))
+
+    def pack(self, fmt: str, *values):
+        self._buffer += struct.pack("<" + fmt, *values)
+
+    def array(self, values: np.ndarray, dtype: np.dtype):
+        self._buffer += bytes(-len(self._buffer) % 8)
+        self._buffer += np.ascontiguousarray(values, dtype=dtype).tobytes()
+
+    def ids(self, ids: List[Union[str, int]]):
+        for node_id in ids:
+            if not isinstance(node_id, str) and type(node_id) is not int:
+                raise ValueError("Node ids must be strings or ints, got {!r}".format(node_id))
+        encoded = [str(node_id).encode("utf-8") for node_id in ids]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.uint32)
+        offsets[1:] = np.cumsum([len(value) for value in encoded])
+        self.pack("I", len(encoded))
+        self.array(offsets, "<u4")
+        self.array([type(node_id) is int for node_id in ids], "<u1")
+        self._buffer += b"".join(encoded)
+
+    def getvalue(self) -> bytes:
+        return bytes(self._buffer)
+
+
+class _Reader:
+    def __init__(self, data: bytes, kind: int):
+        self._data = memoryview(data)
+        if len(self._data) < _header.size:
+            raise ValueError("Message is too short")
+        magic, version, message_kind = _header.unpack_from(self._data, 0)
+        if magic != _magic:
+            raise ValueError("Not a pybeepbeep message")
+        if version != _version:
+            raise ValueError("Unsupported message version {}".format(version))
+        if message_kind != kind:
+            raise ValueError("Expected message kind {}, got {}".format(kind, message_kind))
+        self._offset = _header.size
+
+    def unpack(self, fmt: str) -> tuple:
+        fmt = struct.Struct("<" + fmt)
+        values = fmt.unpack_from(self._data, self._offset)
+        self._offset += fmt.size
+        return values
+
+    def array(self, dtype: np.dtype, count: int) -> np.ndarray:
+        self._offset += -self._offset % 8
+        values = np.frombuffer(self._data, dtype=dtype, count=count, offset=self._offset)
+        self._offset += values.nbytes
+        return values
+
+    def ids(self) -> List[Union[str, int]]:
+        count, = self.unpack("I")
+        offsets = self.array("<u4", count + 1)
+        is_int = self.array("<u1", count)
+        blob = self._data[self._offset:self._offset + int(offsets[-1])]
+        self._offset += int(offsets[-1])
+        ids = [str(blob[start:end], "utf-8") for start, end in zip(offsets[:-1], offsets[1:])]
+        return [int(node_id) if flag else node_id for node_id, flag in zip(ids, is_int)]
+
+
+def _index_dtype_code(n_values: int) -> int:
+    for code, dtype in enumerate(_index_dtypes):
+        if n_values <= np.iinfo(dtype).max + 1:
+            return code
+    raise ValueError("Too many distinct values")
+
+
+def _slots(values: List) -> Tuple[float, float, np.ndarray]:
+    # express the values as base + slot * step with integer slots, the way the schedulers compute time_s, returns
+    # None unless that reproduces every value exactly
+    if len(values) == 0 or any(not isinstance(value, float) for value in values):
+        return None
+
+    unique = np.unique(values)
+    base = float(unique[0])
+    steps = np.diff(unique)
+    if len(steps) == 0:
+        return base, 0.0, np.zeros(len(values), dtype=np.int64)
+
+    step = float(steps[0])
+    if step <= 0:
+        return None
+
+    slots = np.rint((np.array(values) - base) / step).astype(np.int64)
+    if np.any(np.abs(np.diff(slots, prepend=0)) > np.iinfo(np.int32).max):
+        return None
+    if any(int(slot) * step + base != value for slot, value in zip(slots, values)):
+        return None
+
+    return base, step, slots
+
+
+def _write_column(writer: _Writer, values: List):
+    slots = _slots(values)
+    if slots is not None:
+        base, step, slots = slots
+        deltas = np.diff(slots, prepend=0)
+        slot_code = next(code for code, dtype in enumerate(_slot_dtypes)
+                         if len(deltas) == 0 or np.max(np.abs(deltas)) <= np.iinfo(dtype).max)
+        writer.pack("BB", _column_slots, slot_code)
+        writer.pack("dd", base, step)
+        writer.array(deltas, _slot_dtypes[slot_code])
+        return
+
+    # a table of distinct values, flagging the ones that were ints so they decode back to ints
+    lookup = {}
+    for value in values:
+        lookup.setdefault((type(value) is int, float(value)), len(lookup))
+    table = sorted(lookup, key=lookup.get)
+    index_code = _index_dtype_code(len(table))
+
+    writer.pack("BBI", _column_table, index_code, len(table))
+    writer.array([value for _, value in table], "<f8")
+    writer.array([is_int for is_int, _ in table], "<u1")
+    writer.array([lookup[(type(value) is int, float(value))] for value in values], _index_dtypes[index_code])
+
+
+def _read_column(reader: _Reader, count: int) -> List:
+    mode, = reader.unpack("B")
+    if mode == _column_slots:
+        slot_code, = reader.unpack("B")
+        base, step = reader.unpack("dd")
+        slots = np.cumsum(reader.array(_slot_dtypes[slot_code], count), dtype=np.int64)
+        return [int(slot) * step + base for slot in slots]
+
+    if mode != _column_table:
+        raise ValueError("Unknown column encoding {}".format(mode))
+
+    index_code, n_values = reader.unpack("BI")
+    table = reader.array("<f8", n_values)
+    is_int = reader.array("<u1", n_values)
+    values = [int(value) if flag else float(value) for value, flag in zip(table, is_int)]
+    return [values[i] for i in reader.array(_index_dtypes[index_code], count)]
+
+
+def encode_schedule(schedule: List[Dict]) -> bytes:
+    """
+    Encodes a schedule as produced by generate_schedule.
+
+    target_hz and duration_ms are stored as tables of distinct values with a small index per entry. time_s is stored
+    as delta-encoded integer slots when the times lie on a regular grid, which is the case for the bundled schedulers,
+    and as a table otherwise. Decoding gives back an identical list of dicts, including int vs float values.
+    """
+    for entry in schedule:
+        if set(entry.keys()) != set(_schedule_keys):
+            raise ValueError("Schedule entries must have exactly the keys {}".format(", ".join(_schedule_keys)))
+
+    writer = _Writer(_kind_schedule)
+    writer.ids([entry["id"] for entry in schedule])
+    for key in _schedule_keys[1:]:
+        _write_column(writer, [entry[key] for entry in schedule])
+    return writer.getvalue()
+
+
+def decode_schedule(data: bytes) -> List[Dict]:
+    reader = _Reader(data, _kind_schedule)
+    ids = reader.ids()
+    columns = [_read_column(reader, len(ids)) for _ in _schedule_keys[1:]]
+    return [dict(zip(_schedule_keys, values)) for values in zip(ids, *columns)]
+
+
+def encode_deltas(deltas: np.ndarray, ids: List[str]) -> bytes:
+    """
+    Encodes one row of find_deltas output, or a matrix of rows, with the ids of the schedule entries as columns.
+    """
+    deltas = np.asarray(deltas, dtype=np.float64)
+    if deltas.ndim not in (1, 2) or deltas.shape[-1] != len(ids):
+        raise ValueError("Deltas must be a row or matrix with one column per id")
+
+    writer = _Writer(_kind_deltas)
+    writer.ids(ids)
+    writer.pack("BII", deltas.ndim, *((1,) + deltas.shape)[-2:])
+    writer.array(deltas, "<f8")
+    return writer.getvalue()
+
+
+def decode_deltas(data: bytes) -> Tuple[List[str], np.ndarray]:
+    """
+    Returns the ids and a read-only view of the deltas in data.
+    """
+    reader = _Reader(data, _kind_deltas)
+    ids = reader.ids()
+    ndim, rows, columns = reader.unpack("BII")
+    deltas = reader.array("<f8", rows * columns).reshape((rows, columns))
+    return ids, deltas[0] if ndim == 1 else deltas
+
+
+def encode_distances(distances: np.ndarray, ids: List[str], dtype: np.dtype = np.float32) -> bytes:
+    """
+    Encodes the upper triangle, including the diagonal, of a symmetric distance matrix from calculate_distances.
+
+    Distances are stored as float32 by default, pass dtype=np.float64 to keep them exactly.
+    """
+    distances = np.asarray(distances)
+    if distances.shape != (len(ids), len(ids)):
+        raise ValueError("Distances must be a square matrix with one row per id")
+    dtype_code = [value.type for value in _value_dtypes].index(np.dtype(dtype).type)
+
+    writer = _Writer(_kind_distances)
+    writer.ids(ids)
+    writer.pack("B", dtype_code)
+    writer.array(distances[np.triu_indices(len(ids))], _value_dtypes[dtype_code])
+    return writer.getvalue()
+
+
+def decode_distances(data: bytes, packed: bool = False) -> Tuple[List[str], np.ndarray]:
+    """
+    Returns the ids and the symmetric distance matrix in data.
+
+    With packed=True the row-major upper triangle is returned instead, as a read-only view of data.
+    """
+    reader = _Reader(data, _kind_distances)
+    ids = reader.ids()
+    dtype_code, = reader.unpack("B")
+    n = len(ids)
+    triangle = reader.array(_value_dtypes[dtype_code], n * (n + 1) // 2)
+    if packed:
+        return ids, triangle
+
+    distances = np.empty((n, n), dtype=triangle.dtype)
+    rows, columns = np.triu_indices(n)
+    distances[rows, columns] = triangle
+    distances[columns, rows] = triangle
+    return ids, distances
+
+
+def encode_indexed_distances(indexed_distances: Dict[str, Dict], dtype: np.dtype = np.float64) -> bytes:
+    """
+    Encodes the nested dicts produced by index_distances.
+
+    Unlike encode_distances this defaults to float64, so the dicts decode exactly as they were encoded. Pass
+    dtype=np.float32 to halve the size at the cost of rounding.
+    """
+    ids = list(indexed_distances.keys())
+    distances = np.array([[indexed_distances[i][j] for j in ids] for i in ids], dtype=np.float64)
+    return encode_distances(distances, ids, dtype=dtype)
+
+
+def decode_indexed_distances(data: bytes) -> Dict[str, Dict]:
+    ids, distances = decode_distances(data)
+    return {i_id: {j_id: float(distances[i][j]) for j, j_id in enumerate(ids)} for i, i_id in enumerate(ids)}
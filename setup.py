@@ -22,14 +22,24 @@ setup(
         'Operating System :: OS Independent',
     ],
     packages=find_packages(exclude=["tests"]),
+    entry_points={
+        'console_scripts': [
+            'pybeepbeep=pybeepbeep.cli:main',
+        ]
+    },
     install_requires=[
         'numpy',
         'scipy',
-        'librosa',
         'pytest-cov',
         'setuptools-git-version',
     ],
     extras_require={
+        'numba': [
+            'numba',
+        ],
+        'test': [
+            'librosa',
+        ],
         'lint': [
             'flake8',
             'flake8-import-order',
@@ -0,0 +1,12 @@
+from pybeepbeep import backends
+
+import pytest
+
+
+@pytest.fixture(autouse=True, params=backends.available_backends())
+def backend(request):
+    # every test runs once per installed backend, so each backend is held to the whole suite
+    previous = backends.get_backend()
+    backends.set_backend(request.param)
+    yield backends.get_backend()
+    backends.set_backend(previous.name)
@@ -0,0 +1,23 @@
+from typing import Dict, List, Sequence, Tuple
+
+from pybeepbeep.ranging import generate_schedule
+from pybeepbeep.simulation import SimulatedRound, simulate_round
+
+
+def simulate_schedule(positions: Dict[str, Sequence[float]],
+                      sampling_freq_hz: float = 44100.0,
+                      target_hz: float = 6000.0,
+                      duration_ms: float = 10.0,
+                      **kwargs) -> Tuple[List[Dict], SimulatedRound]:
+    """
+    Schedules one beep per node in positions with generate_schedule and simulates the round, passing kwargs on to
+    simulate_round. Returns the schedule and the simulated round.
+    """
+    nodes = list(positions.keys())
+    schedule = generate_schedule(nodes=nodes,
+                                 scheduler_kwargs={
+                                     "target_hz": target_hz,
+                                     "duration_ms": duration_ms
+                                 })
+    simulated = simulate_round(positions=positions, schedule=schedule, sampling_freq_hz=sampling_freq_hz, **kwargs)
+    return schedule, simulated
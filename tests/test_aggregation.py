@@ -0,0 +1,133 @@
+import numpy as np
+
+from pybeepbeep.aggregation import DistanceAggregator
+
+
+def noisy_rounds(truth: np.ndarray, n_rounds: int, noise_std: float, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    for _ in range(n_rounds):
+        noise = rng.normal(scale=noise_std, size=truth.shape)
+        noise = np.triu(noise) + np.triu(noise, 1).T
+        yield truth + noise
+
+
+def test_aggregate_noisy_rounds():
+    truth = np.array([[0.0, 1.0, 2.0],
+                      [1.0, 0.0, 3.0],
+                      [2.0, 3.0, 0.0]])
+
+    aggregator = DistanceAggregator(n_nodes=3)
+    for distances in noisy_rounds(truth, n_rounds=200, noise_std=.05):
+        aggregator.update(distances)
+
+    assert np.all(np.abs(aggregator.estimate() - truth) < .05)
+    assert np.all(np.abs(aggregator.estimate(robust=False) - truth) < .05)
+    assert np.all(aggregator.confidence() < .05)
+    assert np.array_equal(aggregator.estimate(), aggregator.estimate().T)
+
+
+def test_aggregate_rejects_outliers():
+    truth = np.array([[0.0, 1.0],
+                      [1.0, 0.0]])
+
+    aggregator = DistanceAggregator(n_nodes=2)
+    for distances in noisy_rounds(truth, n_rounds=50, noise_std=.01):
+        aggregator.update(distances)
+
+    outlier = truth.copy()
+    outlier[0, 1] = outlier[1, 0] = 25.0
+    aggregator.update(outlier)
+
+    assert aggregator.rejected[0, 1] == 1
+    assert abs(aggregator.estimate()[0, 1] - 1.0) < .02
+    assert abs(aggregator.estimate(robust=False)[0, 1] - 1.0) < .02
+
+
+def test_aggregate_follows_moved_nodes():
+    aggregator = DistanceAggregator(n_nodes=2, max_rejections=3)
+    for distances in noisy_rounds(np.array([[0.0, 1.0], [1.0, 0.0]]), n_rounds=50, noise_std=.01):
+        aggregator.update(distances)
+
+    for distances in noisy_rounds(np.array([[0.0, 5.0], [5.0, 0.0]]), n_rounds=100, noise_std=.01, seed=1):
+        aggregator.update(distances)
+
+    assert aggregator.rejected[0, 1] == 3
+    assert abs(aggregator.estimate(robust=False)[0, 1] - 5.0) < .02
+
+
+def test_aggregate_missing_detections():
+    aggregator = DistanceAggregator(n_nodes=3)
+
+    aggregator.update(np.array([[0.0, 1.0, np.inf],
+                                [1.0, 0.0, np.inf],
+                                [np.inf, np.inf, 0.0]]))
+    aggregator.update(np.array([[0.0, np.inf, np.inf],
+                                [np.inf, 0.0, np.inf],
+                                [np.inf, np.inf, 0.0]]))
+
+    estimate = aggregator.estimate()
+    assert estimate[0, 1] == 1.0
+    assert np.isinf(estimate[0, 2])
+    assert aggregator.missing[0, 1] == 1
+    assert aggregator.detection_rate()[0, 1] == .5
+    assert aggregator.detection_rate()[1, 2] == 0
+
+
+def test_aggregate_sparse_updates():
+    aggregator = DistanceAggregator(n_nodes=3)
+
+    aggregator.update_pairs(rows=[0, 1], columns=[1, 2], distances=[1.5, 2.5])
+
+    estimate = aggregator.estimate()
+    assert estimate[0, 1] == estimate[1, 0] == 1.5
+    assert estimate[1, 2] == estimate[2, 1] == 2.5
+    assert np.isnan(estimate[0, 2])
+    assert aggregator.count[0, 1] == 1
+    assert aggregator.count[0, 0] == 0
+
+
+def test_aggregate_sparse_updates_match_dense():
+    truth = np.array([[0.0, 1.0, 2.0],
+                      [1.0, 0.0, 3.0],
+                      [2.0, 3.0, 0.0]])
+    rows, columns = np.triu_indices(3)
+
+    dense = DistanceAggregator(n_nodes=3)
+    sparse = DistanceAggregator(n_nodes=3)
+    for i, distances in enumerate(noisy_rounds(truth, n_rounds=50, noise_std=.05)):
+        if i % 7 == 3:
+            distances[0, 2] = distances[2, 0] = 10.0
+        if i % 11 == 5:
+            distances[1, 2] = distances[2, 1] = np.inf
+        dense.update(distances)
+        sparse.update_pairs(rows, columns, distances[rows, columns])
+
+    for name in ("mean", "var", "median", "count", "missing", "rejected"):
+        np.testing.assert_array_equal(getattr(sparse, name), getattr(dense, name))
+
+
+def test_aggregate_quantized_distances():
+    quantum = 343 / (2 * 44100)
+    rounds = [1.0] * 10 + [1.0, 1.0 + quantum] * 100
+
+    aggregator = DistanceAggregator(n_nodes=2)
+    for distance in rounds:
+        aggregator.update(np.array([[0.0, distance], [distance, 0.0]]))
+
+    assert aggregator.rejected[0, 1] == 0
+    assert aggregator.var[0, 1] > 0
+    assert 1.0 < aggregator.estimate(robust=False)[0, 1] < 1.0 + quantum
+    assert 1.0 < aggregator.estimate()[0, 1] < 1.0 + quantum
+    assert aggregator.confidence()[0, 1] > 0
+
+
+def test_aggregate_confidence_after_one_round():
+    aggregator = DistanceAggregator(n_nodes=2)
+    aggregator.update(np.array([[0.0, 1.0], [1.0, 0.0]]))
+
+    confidence = aggregator.confidence()
+    assert not np.any(np.isnan(confidence))
+    np.testing.assert_allclose(confidence, aggregator.min_std)
+
+    aggregator.update(np.array([[0.0, 1.0], [1.0, 0.0]]))
+    assert not np.any(np.isnan(aggregator.confidence()))
@@ -0,0 +1,84 @@
+import numpy as np
+
+from pybeepbeep import backends
+from pybeepbeep.ranging import BeepDetector, calculate_distances, tone
+
+import pytest
+
+from scipy.signal import find_peaks
+
+
+def test_first_peak_above_matches_find_peaks(backend):
+    rng = np.random.default_rng(3)
+    detector = BeepDetector()
+    for _ in range(200):
+        # rounding makes flat peaks, whose index find_peaks reports as the middle of the plateau
+        envelope = np.round(rng.random(rng.integers(0, 50)) * 4)
+        threshold = rng.random() * 4
+
+        peaks, _ = find_peaks(envelope)
+        peaks = peaks[envelope[peaks] > threshold]
+        expected = int(peaks[0]) if len(peaks) > 0 else -1
+
+        assert backend.first_peak_above(envelope, threshold) == expected
+        # scratch buffers are reused between envelopes of the same length
+        assert backend.first_peak_above(envelope, threshold, detector._buffer) == expected
+
+
+def test_distances_match_numpy(backend):
+    deltas = np.abs(np.random.default_rng(5).normal(size=(6, 6)) * 100)
+    deltas[2, 4] = np.inf
+    deltas[5, 0] = np.nan
+
+    with np.errstate(invalid='ignore'):
+        expected = backends.get_backend("numpy").distances(deltas, 343 / 88200)
+        distances = backend.distances(deltas, 343 / 88200)
+
+    np.testing.assert_array_equal(distances, expected)
+
+    # an inf on the diagonal alone gives inf distances rather than nan ones
+    deltas = np.array([[np.inf, 1.0, 2.0], [3.0, 0.0, 4.0], [5.0, 6.0, 0.0]])
+    with np.errstate(invalid='ignore'):
+        expected = backends.get_backend("numpy").distances(deltas, 343 / 88200)
+        distances = backend.distances(deltas, 343 / 88200)
+
+    assert np.all(np.isinf(expected[0, 1:]))
+    np.testing.assert_array_equal(distances, expected)
+
+
+def test_detector_backend_overrides_selection():
+    fs = 44100
+    samples = np.zeros(fs // 10)
+    signal = tone(6000.0, fs, .01)
+    samples[1000:1000 + len(signal)] += signal
+
+    detector = BeepDetector(backend=backends.get_backend("numpy"))
+
+    assert detector.find_beep(samples, fs, 6000.0, 10.0) == 1000
+    assert detector.backend.name == "numpy"
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        backends.set_backend("missing")
+
+
+def test_register_backend():
+    class ScaledBackend(backends.NumpyBackend):
+        name = "scaled"
+
+        def distances(self, deltas, conversion_factor):
+            return 2 * super().distances(deltas, conversion_factor)
+
+    backends.register_backend(ScaledBackend.name, ScaledBackend)
+    try:
+        assert "scaled" in backends.available_backends()
+        backends.set_backend("scaled")
+        deltas = np.array([[0.0, 10.0], [10.0, 0.0]])
+        np.testing.assert_array_equal(calculate_distances(deltas, 44100), [[0.0, 0.0], [0.0, 0.0]])
+        deltas = np.array([[0.0, 20.0], [10.0, 0.0]])
+        assert calculate_distances(deltas, 44100)[0, 1] == pytest.approx(2 * 343 / 88200 * 10)
+    finally:
+        backends.set_backend("numpy")
+        del backends._backend_factories["scaled"]
+        backends._backend_instances.pop("scaled", None)
@@ -1,13 +1,18 @@
+import threading
+import tracemalloc
 from typing import Dict, List
 
-from librosa.core import samples_to_time, time_to_samples
-from librosa.core import tone as create_tone
-
 import numpy as np
 
-from pybeepbeep.ranging import _calculate_windows_for_schedule, _find_beep_in_window, _get_window_size_ms, \
-    band_scheduler, find_deltas, generate_schedule
+from pybeepbeep.backends import _fft_supports_out
+from pybeepbeep.ranging import BeepDetector, _calculate_windows_for_schedule, _default_detector, _find_beep_in_window, \
+    _get_window_size_ms, band_scheduler, find_deltas, find_detections, generate_schedule, samples_to_time, \
+    time_to_samples
+from pybeepbeep.ranging import tone as create_tone
+
+import pytest
 
+from scipy.signal import correlate, hilbert
 from scipy.signal.windows import hamming
 
 
@@ -225,3 +230,225 @@ def test_find_deltas_multi_tone():
             0, time_to_samples(window / 1000, sr=f_sampling), 0, time_to_samples(window / 1000, sr=f_sampling)
         ]
     )
+
+
+def test_detector_matches_scipy_correlation():
+    rng = np.random.default_rng(0)
+    samples = rng.standard_normal(4410)
+    signal = create_tone(frequency=8000.0, sr=44100.0, duration=.01)
+
+    detector = BeepDetector()
+    expected_correlation = correlate(samples, signal, mode='valid', method='fft')
+    correlation = detector._correlate(samples, signal, (44100.0, 8000.0, 10.0))
+
+    assert np.allclose(correlation, expected_correlation)
+    assert np.allclose(detector._envelope(correlation), np.abs(hilbert(expected_correlation)))
+
+
+def test_detector_reuses_buffers():
+    clip = create_clip(
+        [
+            {"freq_hz": 8000.0, "duration_s": .05, "start_s": 2.5}
+        ],
+        background_freq_hz=1000.0
+    )
+
+    detector = BeepDetector()
+    first = detector.find_beep(samples=clip, sampling_freq_hz=44100.0, target_signal_freq_hz=8000.0, duration_ms=50.0)
+    buffers = {key: buffer.ctypes.data for key, buffer in detector._buffers.items()}
+    second = detector.find_beep(samples=clip, sampling_freq_hz=44100.0, target_signal_freq_hz=8000.0, duration_ms=50.0)
+
+    assert first == second
+    assert abs(samples_to_time(first, 44100) - 2.5) < onset_accuracy_threshold
+    assert {key: buffer.ctypes.data for key, buffer in detector._buffers.items()} == buffers
+
+
+def test_default_detector_per_thread():
+    detector = _default_detector()
+    assert _default_detector() is detector
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(_default_detector()))
+    thread.start()
+    thread.join()
+    assert other[0] is not detector
+
+
+@pytest.mark.skipif(not _fft_supports_out, reason="NumPy before 2.0 cannot write FFT results into buffers")
+@pytest.mark.parametrize("block_ms", [None, 500.0])
+def test_detect_steady_state_allocations(block_ms):
+    clip = create_clip(
+        [
+            {"freq_hz": 8000.0, "duration_s": .05, "start_s": 2.5}
+        ],
+        background_freq_hz=1000.0
+    )
+
+    detector = BeepDetector()
+    kwargs = {"samples": clip, "sampling_freq_hz": 44100.0, "target_signal_freq_hz": 8000.0, "duration_ms": 50.0,
+              "block_size": None if block_ms is None else int(time_to_samples(block_ms / 1000.0, 44100.0))}
+    expected = detector.detect(**kwargs)
+
+    tracemalloc.start()
+    try:
+        detection = detector.detect(**kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert detection == expected
+    # only NumPy's FFT scratch space remains, the window alone takes several MB
+    assert peak < clip.nbytes / 8
+
+
+def test_tone_matches_librosa():
+    librosa = pytest.importorskip("librosa")
+
+    for frequency, sr, duration in [(8000.0, 44100.0, .05), (1000.0, 44100.0, .001), (6000, 48000, .0123)]:
+        expected = librosa.tone(frequency, sr=sr, duration=duration)
+        assert np.array_equal(create_tone(frequency=frequency, sr=sr, duration=duration), expected)
+
+
+def test_time_conversions_match_librosa():
+    librosa = pytest.importorskip("librosa")
+
+    times = np.array([0, .001, .5, 2.5, 3.14159, 1000.0])
+    for sr in [22050, 44100.0, 48000]:
+        assert np.array_equal(time_to_samples(times, sr), librosa.time_to_samples(times, sr=sr))
+        assert time_to_samples(2.5, sr) == librosa.time_to_samples(2.5, sr=sr)
+        samples = time_to_samples(times, sr)
+        assert np.array_equal(samples_to_time(samples, sr), librosa.samples_to_time(samples, sr=sr))
+
+
+def test_detect_confidence():
+    clip = create_clip(
+        [
+            {"freq_hz": 8000.0, "duration_s": .05, "start_s": 2.5}
+        ],
+        background_freq_hz=1000.0
+    )
+
+    detection = BeepDetector().detect(samples=clip,
+                                      sampling_freq_hz=44100.0,
+                                      target_signal_freq_hz=8000.0,
+                                      duration_ms=50.0)
+
+    assert abs(samples_to_time(detection.onset, 44100) - 2.5) < onset_accuracy_threshold
+    assert detection.peak_ratio > 1
+    assert detection.snr_db > 20
+
+
+def test_detect_none_confidence():
+    detection = BeepDetector().detect(samples=create_clip(),
+                                      sampling_freq_hz=44100.0,
+                                      target_signal_freq_hz=8000.0,
+                                      duration_ms=50.0)
+
+    assert detection.onset is None
+    assert detection.peak_ratio == 0
+
+
+def test_detect_blocks_exit_early():
+    clip = create_clip(
+        [
+            {"freq_hz": 8000.0, "duration_s": .05, "start_s": .5},
+            {"freq_hz": 8000.0, "duration_s": .05, "start_s": 3.5}
+        ],
+        background_freq_hz=1000.0
+    )
+
+    detector = BeepDetector()
+    full = detector.detect(samples=clip, sampling_freq_hz=44100.0, target_signal_freq_hz=8000.0, duration_ms=50.0)
+
+    searched = []
+    search = detector._search
+
+    def counting_search(samples, signal, template_key, skip=0):
+        searched.append(len(samples))
+        return search(samples, signal, template_key, skip=skip)
+
+    detector._search = counting_search
+    blocked = detector.detect(samples=clip,
+                              sampling_freq_hz=44100.0,
+                              target_signal_freq_hz=8000.0,
+                              duration_ms=50.0,
+                              block_size=time_to_samples(.25, 44100))
+
+    assert abs(samples_to_time(blocked.onset, 44100) - .5) < onset_accuracy_threshold
+    assert abs(int(blocked.onset) - int(full.onset)) <= 1
+    assert blocked.snr_db > 20
+    assert sum(searched) < len(clip) / 2
+
+
+@pytest.mark.parametrize("offset", [0, 30, 45, 65, 100, 150])
+def test_detect_blocks_beep_after_boundary(offset):
+    f_sampling = 44100
+    samples = np.zeros(4410)
+    block_size = len(samples) // 7
+    beep = create_tone(frequency=6000.0, sr=f_sampling, duration=.01)
+    detector = BeepDetector()
+
+    for block in range(1, 6):
+        samples[:] = 0
+        start = block * block_size + offset
+        samples[start:start + len(beep)] = beep
+
+        full = detector.detect(samples, f_sampling, 6000.0, 10.0)
+        blocked = detector.detect(samples, f_sampling, 6000.0, 10.0, block_size=block_size)
+
+        assert blocked.onset == full.onset
+        assert abs(blocked.onset - start) <= 1
+
+
+def test_detect_blocks_ignore_neighbouring_channel():
+    f_sampling = 44100
+    samples = np.zeros(f_sampling // 5)
+    neighbour = create_tone(frequency=1000.0, sr=f_sampling, duration=.01)
+    target = create_tone(frequency=2000.0, sr=f_sampling, duration=.01)
+    samples[2000:2000 + len(neighbour)] += neighbour
+    samples[5000:5000 + len(target)] += .1 * target
+    detector = BeepDetector()
+
+    full = detector.detect(samples, f_sampling, 2000.0, 10.0)
+    blocked = detector.detect(samples, f_sampling, 2000.0, 10.0, block_size=882)
+
+    assert full.onset == 5000
+    assert blocked.onset == full.onset
+
+
+def test_detect_blocks_fall_back_to_window():
+    rng = np.random.default_rng(0)
+    clip = rng.standard_normal(time_to_samples(1, 44100))
+
+    detection = BeepDetector().detect(samples=clip,
+                                      sampling_freq_hz=44100.0,
+                                      target_signal_freq_hz=8000.0,
+                                      duration_ms=50.0,
+                                      block_size=time_to_samples(.1, 44100))
+
+    assert detection.snr_db < 20
+
+
+def test_find_detections_block_search():
+    f_sampling = 44100.0
+    nodes = ['1', '2', '3', '4']
+
+    schedule = generate_schedule(nodes=nodes,
+                                 schedule_strategy=band_scheduler,
+                                 scheduler_kwargs={
+                                     "channels": [1000.0, 2000.0],
+                                     "duration_ms": 5.0
+                                 })
+
+    tones = [{"freq_hz": entry["target_hz"], "duration_s": entry["duration_ms"] / 1000.0, "start_s": entry["time_s"]}
+             for entry in schedule]
+
+    clip = create_clip(tones=tones, duration_s=2.0, sampling_rate_hz=f_sampling)
+
+    detections = find_detections(samples=clip, sampling_freq_hz=f_sampling, schedule=schedule, block_ms=20.0)
+
+    assert [abs(samples_to_time(detection.onset, f_sampling) - entry["time_s"]) < onset_accuracy_threshold
+            for detection, entry in zip(detections, schedule)] == [True] * 4
+    assert np.array_equal(find_deltas(samples=clip, sampling_freq_hz=f_sampling, schedule=schedule, self_id='1',
+                                      block_ms=20.0),
+                          find_deltas(samples=clip, sampling_freq_hz=f_sampling, schedule=schedule, self_id='1'))
@@ -0,0 +1,81 @@
+import numpy as np
+
+from pybeepbeep import ranging
+from pybeepbeep.cache import DetectionCache
+from pybeepbeep.ranging import Detection, find_deltas
+
+from tests.rounds import simulate_schedule
+
+
+def test_cache_get_put(tmp_path):
+    samples = np.arange(100, dtype=np.float64)
+
+    with DetectionCache(str(tmp_path / "cache.db")) as cache:
+        key = cache.key(samples=samples, sampling_freq_hz=44100.0, target_signal_freq_hz=8000.0, duration_ms=50.0)
+        missing_key = cache.key(samples=samples, sampling_freq_hz=44100.0, target_signal_freq_hz=8000.0,
+                                duration_ms=10.0)
+
+        assert cache.get(key) == (False, None)
+
+        detection = Detection(onset=42, peak_ratio=1.1, snr_db=30.0)
+        missing = Detection(onset=None, peak_ratio=0.0, snr_db=-np.inf)
+        cache.put(key, detection)
+        cache.put(missing_key, missing)
+
+        assert cache.get(key) == (True, detection)
+        assert cache.get(missing_key) == (True, missing)
+
+    with DetectionCache(str(tmp_path / "cache.db")) as cache:
+        assert cache.get(key) == (True, detection)
+
+
+def test_cache_key_depends_on_samples():
+    samples = np.zeros(100)
+    other_samples = np.zeros(100)
+    other_samples[50] = 1
+
+    key = DetectionCache.key(samples=samples, sampling_freq_hz=44100.0, target_signal_freq_hz=8000.0,
+                             duration_ms=50.0)
+    other_key = DetectionCache.key(samples=other_samples, sampling_freq_hz=44100.0, target_signal_freq_hz=8000.0,
+                                   duration_ms=50.0)
+
+    assert key != other_key
+
+
+def test_cache_eviction(tmp_path):
+    with DetectionCache(str(tmp_path / "cache.db"), max_entries=10) as cache:
+        keys = [bytes([i]) for i in range(10)]
+        for i, key in enumerate(keys):
+            cache.put(key, Detection(onset=i, peak_ratio=1.0, snr_db=20.0))
+
+        # touch the first key so it is the most recently used
+        cache.get(keys[0])
+        cache.put(b"new", Detection(onset=100, peak_ratio=1.0, snr_db=20.0))
+
+        assert len(cache) <= 10
+        assert cache.get(keys[0])[1].onset == 0
+        assert cache.get(keys[1]) == (False, None)
+        assert cache.get(b"new")[1].onset == 100
+
+
+def test_find_deltas_with_cache(tmp_path, monkeypatch):
+    f_sampling = 44100.0
+    positions = {'1': (0.0, 0.0), '2': (1.5, 0.0), '3': (0.0, 2.0)}
+    schedule, simulated = simulate_schedule(positions, f_sampling)
+    recording = simulated.recordings[0]
+
+    expected_deltas = find_deltas(samples=recording, sampling_freq_hz=f_sampling, schedule=schedule, self_id='1')
+
+    with DetectionCache(str(tmp_path / "cache.db")) as cache:
+        deltas = find_deltas(samples=recording, sampling_freq_hz=f_sampling, schedule=schedule, self_id='1',
+                             cache=cache)
+        assert np.array_equal(deltas, expected_deltas)
+
+        def fail(self, **kwargs):
+            raise AssertionError("cached windows should not be searched again")
+
+        monkeypatch.setattr(ranging.BeepDetector, "detect", fail)
+
+        deltas = find_deltas(samples=recording, sampling_freq_hz=f_sampling, schedule=schedule, self_id='1',
+                             cache=cache)
+        assert np.array_equal(deltas, expected_deltas)
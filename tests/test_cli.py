@@ -0,0 +1,118 @@
+import json
+
+import numpy as np
+
+from pybeepbeep import cli
+from pybeepbeep.cli import main
+from pybeepbeep.wire import decode_distances, encode_schedule
+
+from scipy.io import wavfile
+
+from tests.rounds import simulate_schedule
+
+
+distance_accuracy_threshold_m = .01
+
+
+def write_round(tmp_path, f_sampling=44100):
+    positions = {'1': (0.0, 0.0), '2': (2.0, 0.0), '3': (0.0, 1.0)}
+    schedule, simulated = simulate_schedule(positions, f_sampling)
+
+    schedule_path = tmp_path / "schedule.json"
+    schedule_path.write_text(json.dumps(schedule))
+
+    recordings_dir = tmp_path / "recordings"
+    recordings_dir.mkdir()
+    for node, recording in zip(simulated.ids, simulated.recordings):
+        wavfile.write(str(recordings_dir / (node + ".wav")), f_sampling, recording.astype(np.float32))
+
+    return schedule_path, recordings_dir, simulated
+
+
+def test_cli_batch(tmp_path, capsys):
+    schedule_path, recordings_dir, simulated = write_round(tmp_path)
+    output_dir = tmp_path / "output"
+
+    assert main([str(schedule_path), str(recordings_dir), str(output_dir), "--workers", "2"]) == 0
+
+    ids, distances = decode_distances((output_dir / "distances.bin").read_bytes())
+    assert ids == simulated.ids
+    assert np.all(np.abs(distances - simulated.distances) < distance_accuracy_threshold_m)
+    assert "processed 3 recordings (0 skipped, 0 failed)" in capsys.readouterr().out
+
+
+def test_cli_resume(tmp_path, capsys):
+    schedule_path, recordings_dir, simulated = write_round(tmp_path)
+    output_dir = tmp_path / "output"
+
+    assert main([str(schedule_path), str(recordings_dir), str(output_dir), "--workers", "1"]) == 0
+    (output_dir / "deltas" / "2.npy").unlink()
+    capsys.readouterr()
+
+    assert main([str(schedule_path), str(recordings_dir), str(output_dir), "--workers", "1"]) == 0
+
+    ids, distances = decode_distances((output_dir / "distances.bin").read_bytes())
+    assert ids == simulated.ids
+    assert np.all(np.abs(distances - simulated.distances) < distance_accuracy_threshold_m)
+    assert "processed 1 recordings (2 skipped, 0 failed)" in capsys.readouterr().out
+
+
+def test_cli_raw_recordings(tmp_path):
+    schedule_path, recordings_dir, simulated = write_round(tmp_path)
+    for node, recording in zip(simulated.ids, simulated.recordings):
+        (recordings_dir / (node + ".wav")).unlink()
+        recording.astype(np.float32).tofile(str(recordings_dir / (node + ".raw")))
+    schedule_path.write_bytes(encode_schedule(json.loads(schedule_path.read_text())))
+    output_dir = tmp_path / "output"
+
+    assert main([str(schedule_path), str(recordings_dir), str(output_dir), "--sampling-rate", "44100"]) == 0
+
+    ids, distances = decode_distances((output_dir / "distances.bin").read_bytes())
+    assert ids == simulated.ids
+    assert np.all(np.abs(distances - simulated.distances) < distance_accuracy_threshold_m)
+
+
+def test_cli_raw_recordings_need_sampling_rate(tmp_path, capsys):
+    schedule_path, recordings_dir, simulated = write_round(tmp_path)
+    recording = simulated.recordings[0]
+    (recordings_dir / (simulated.ids[0] + ".wav")).unlink()
+    recording.astype(np.float32).tofile(str(recordings_dir / (simulated.ids[0] + ".raw")))
+    output_dir = tmp_path / "output"
+
+    assert main([str(schedule_path), str(recordings_dir), str(output_dir)]) == 1
+    assert "--sampling-rate" in capsys.readouterr().err
+    assert not output_dir.exists()
+
+
+def test_cli_schedule_changed(tmp_path, capsys):
+    schedule_path, recordings_dir, simulated = write_round(tmp_path)
+    output_dir = tmp_path / "output"
+
+    assert main([str(schedule_path), str(recordings_dir), str(output_dir), "--workers", "1"]) == 0
+
+    schedule = json.loads(schedule_path.read_text())
+    schedule_path.write_text(json.dumps(schedule[:2]))
+    (recordings_dir / "3.wav").unlink()
+    capsys.readouterr()
+
+    assert main([str(schedule_path), str(recordings_dir), str(output_dir), "--workers", "1"]) == 0
+
+    ids, distances = decode_distances((output_dir / "distances.bin").read_bytes())
+    assert ids == simulated.ids[:2]
+    assert np.all(np.abs(distances - simulated.distances[:2, :2]) < distance_accuracy_threshold_m)
+    out = capsys.readouterr().out
+    assert "discarded 3 previous results" in out
+    assert "processed 2 recordings (0 skipped, 0 failed)" in out
+
+
+def test_worker_reuses_detector(tmp_path):
+    schedule_path, recordings_dir, simulated = write_round(tmp_path)
+    schedule = json.loads(schedule_path.read_text())
+
+    cli._init_worker(schedule, {"sampling_freq_hz": None, "raw_dtype": "float32", "cache_path": None})
+    detector = cli._worker_detector
+    for node in simulated.ids:
+        cli._process_recording(node, str(recordings_dir / (node + ".wav")), str(tmp_path / (node + ".npy")))
+
+    assert cli._worker_detector is detector
+    assert len(detector._templates) == 1
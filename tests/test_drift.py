@@ -0,0 +1,127 @@
+import numpy as np
+
+from pybeepbeep.drift import DriftEstimator, estimate_clock
+from pybeepbeep.ranging import ClockModel, _calculate_windows_for_schedule, find_deltas, find_detections, \
+    generate_schedule, shift_schedule
+from pybeepbeep.simulation import simulate_round
+
+from tests.rounds import simulate_schedule
+
+
+def test_estimate_clock_exact():
+    f_sampling = 44100.0
+    times = np.arange(1, 100) * .3
+    onsets = 1234 + times * f_sampling * (1 + 250e-6)
+
+    clock = estimate_clock(times_s=times, onsets=onsets, sampling_freq_hz=f_sampling)
+
+    assert abs(clock.offset_samples - 1234) < 1e-6
+    assert abs(clock.skew - 250e-6) < 1e-12
+
+
+def test_estimate_clock_ignores_missed_beeps():
+    f_sampling = 44100.0
+    times = [1.0, 2.0, 3.0, 4.0]
+    onsets = [f_sampling, np.inf, 3 * f_sampling, None]
+
+    clock = estimate_clock(times_s=times, onsets=onsets, sampling_freq_hz=f_sampling)
+
+    assert abs(clock.offset_samples) < 1e-6
+    assert abs(clock.skew) < 1e-12
+
+
+def test_single_onset_gives_offset():
+    estimator = DriftEstimator(sampling_freq_hz=44100.0)
+    estimator.add(time_s=1.0, onset=44100.0 + 50)
+
+    assert estimator.clock == ClockModel(offset_samples=50.0, skew=0.0)
+
+
+def test_clock_windows():
+    f_sampling = 44100.0
+    schedule = [{"time_s": 2.5, "duration_ms": 50}]
+
+    windows = _calculate_windows_for_schedule(sampling_freq_hz=f_sampling,
+                                              schedule=schedule,
+                                              clock=ClockModel(offset_samples=100, skew=.001))
+
+    assert windows == [(100 + int(2 * f_sampling * 1.001), 100 + int(3 * f_sampling * 1.001))]
+
+
+def test_drift_over_rounds():
+    f_sampling = 44100.0
+    positions = {'1': (0.0, 0.0), '2': (1.5, 0.0)}
+    skews = {'1': 2e-3, '2': -1e-3}
+    offsets_s = {'1': .01}
+
+    nodes = list(positions.keys())
+
+    round_schedule = generate_schedule(nodes=nodes,
+                                       scheduler_kwargs={
+                                           "target_hz": 6000.0,
+                                           "duration_ms": 5.0
+                                       })
+    period_s = .3
+    rounds = [shift_schedule(round_schedule, r * period_s) for r in range(20)]
+    schedule = [entry for round_entries in rounds for entry in round_entries]
+
+    simulated = simulate_round(positions=positions,
+                               schedule=schedule,
+                               sampling_freq_hz=f_sampling,
+                               clock_offsets_s=offsets_s,
+                               clock_skews=skews)
+
+    for node, recording in zip(simulated.ids, simulated.recordings):
+        estimator = DriftEstimator(sampling_freq_hz=f_sampling)
+        for round_entries in rounds:
+            detections = find_detections(samples=recording,
+                                         sampling_freq_hz=f_sampling,
+                                         schedule=round_entries,
+                                         clock=estimator.clock)
+            estimator.add_detections(detections, round_entries, node)
+
+        clock = estimator.clock
+        expected_offset = offsets_s.get(node, 0.0) * f_sampling * (1 + skews[node])
+        assert abs(clock.skew - skews[node]) < 1e-5
+        assert abs(clock.offset_samples - expected_offset) < 5
+
+        # corrected deltas count nominal samples, i.e. the beep spacing plus the propagation delay
+        deltas = find_deltas(samples=recording,
+                             sampling_freq_hz=f_sampling,
+                             schedule=rounds[-1],
+                             self_id=node,
+                             clock=clock)
+        expected = period_s / 3 * f_sampling + 1.5 / 343 * f_sampling * (1 if node == '1' else -1)
+        assert abs(max(deltas) - expected) < 2
+
+
+def test_clock_capture_started_late():
+    f_sampling = 44100.0
+    positions = {'1': (0.0, 0.0), '2': (1.5, 0.0)}
+    schedule, simulated = simulate_schedule(positions, f_sampling, clock_offsets_s={'1': -.15, '2': -.15})
+    clock = ClockModel(offset_samples=-.15 * f_sampling)
+
+    detections = find_detections(samples=simulated.recordings[0],
+                                 sampling_freq_hz=f_sampling,
+                                 schedule=schedule,
+                                 clock=clock)
+
+    assert abs(detections[0].onset - (schedule[0]["time_s"] - .15) * f_sampling) <= 1
+    assert all(detection.onset is not None for detection in detections)
+
+
+def test_clock_window_outside_recording():
+    f_sampling = 44100.0
+    nodes = ['1']
+    schedule = generate_schedule(nodes=nodes,
+                                 scheduler_kwargs={
+                                     "target_hz": 6000.0,
+                                     "duration_ms": 10.0
+                                 })
+
+    detections = find_detections(samples=np.zeros(1000),
+                                 sampling_freq_hz=f_sampling,
+                                 schedule=schedule,
+                                 clock=ClockModel(offset_samples=-f_sampling))
+
+    assert detections[0].onset is None
@@ -0,0 +1,11 @@
+import subprocess  # noqa: S404
+import sys
+
+
+def test_ranging_import_is_light():
+    # scipy and librosa take seconds to import, neither should be loaded until detection runs
+    code = "import sys, pybeepbeep.ranging; print(sorted(m for m in ('scipy', 'librosa', 'numba') if m in sys.modules))"
+
+    output = subprocess.check_output([sys.executable, "-c", code])  # noqa: S603
+
+    assert output.decode().strip() == "[]"
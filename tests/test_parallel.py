@@ -0,0 +1,75 @@
+import numpy as np
+
+from pybeepbeep.parallel import find_all_deltas, find_all_onsets
+from pybeepbeep.ranging import calculate_distances, find_deltas, find_detections, shift_schedule
+
+import pytest
+
+from tests.rounds import simulate_schedule
+
+
+# shared memory blocks need Python 3.8
+pytest.importorskip("multiprocessing.shared_memory")
+
+
+distance_accuracy_threshold_m = .01
+
+
+def simulate(f_sampling=44100, clock_offset_s=0.0):
+    positions = {'1': (0.0, 0.0), '2': (2.0, 0.0), '3': (0.0, 1.0), '4': (1.5, 1.5)}
+    return simulate_schedule(positions,
+                             f_sampling,
+                             noise_std=.01,
+                             clock_offsets_s={node: clock_offset_s for node in positions},
+                             dtype=np.float32,
+                             seed=7)
+
+
+def test_find_all_deltas_matches_find_deltas():
+    f_sampling = 44100
+    schedule, simulated = simulate(f_sampling)
+    recordings = dict(zip(simulated.ids, simulated.recordings))
+
+    deltas = find_all_deltas(recordings, f_sampling, schedule, workers=2, entries_per_task=3)
+
+    for row, node in enumerate(simulated.ids):
+        expected = find_deltas(samples=simulated.recordings[row],
+                               sampling_freq_hz=f_sampling,
+                               schedule=schedule,
+                               self_id=node)
+        np.testing.assert_array_equal(deltas[row], expected)
+
+    distances = calculate_distances(deltas, f_sampling)
+    assert np.all(np.abs(distances - simulated.distances) < distance_accuracy_threshold_m)
+
+
+def test_find_all_onsets_missing_beeps():
+    f_sampling = 44100
+    schedule, simulated = simulate(f_sampling)
+    recordings = {'1': simulated.recordings[0], 'silent': np.zeros(simulated.recordings.shape[1], dtype=np.float32)}
+
+    onsets = find_all_onsets(recordings, f_sampling, schedule, workers=1)
+    deltas = find_all_deltas(recordings, f_sampling, schedule, workers=1)
+
+    detections = find_detections(samples=simulated.recordings[0], sampling_freq_hz=f_sampling, schedule=schedule)
+    np.testing.assert_array_equal(onsets[0], [detection.onset for detection in detections])
+    np.testing.assert_array_equal(onsets[1], np.full(len(schedule), -1))
+    assert np.all(np.isinf(deltas[1]))
+
+
+def test_find_all_deltas_clips_windows():
+    f_sampling = 44100
+    # every capture started .15 s into the round, so the first window starts before the recordings
+    schedule, simulated = simulate(f_sampling, clock_offset_s=-.15)
+    schedule = shift_schedule(schedule, -.15)
+    recordings = dict(zip(simulated.ids, simulated.recordings))
+
+    deltas = find_all_deltas(recordings, f_sampling, schedule, workers=2)
+
+    for row, node in enumerate(simulated.ids):
+        expected = find_deltas(samples=simulated.recordings[row],
+                               sampling_freq_hz=f_sampling,
+                               schedule=schedule,
+                               self_id=node)
+        np.testing.assert_array_equal(deltas[row], expected)
+    assert np.all(np.isfinite(deltas))
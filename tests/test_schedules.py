@@ -1,4 +1,9 @@
-from pybeepbeep.ranging import band_scheduler, generate_schedule, single_tone_scheduler
+import numpy as np
+
+from pybeepbeep.ranging import band_scheduler, generate_schedule, get_minimum_channel_width, single_tone_scheduler
+from pybeepbeep.scheduling import ScheduleArrays, build_band_schedule, validate_schedule
+
+import pytest
 
 
 def test_single_tone_scheduler_single_node():
@@ -282,3 +287,78 @@ def test_generate_schedule_single_tone_scheduler_multiple_nodes():
                                            })
 
     assert generated_schedule == expected_schedule
+
+
+@pytest.mark.parametrize("n_nodes,channels", [
+    (1, [1000.0]),
+    (7, [1000.0, 2000.0, 3000.0]),
+    (2, [1000.0, 2000.0, 3000.0])
+])
+def test_build_band_schedule_matches_band_scheduler(n_nodes, channels):
+    nodes = [str(i) for i in range(n_nodes)]
+
+    built = build_band_schedule(nodes=nodes, channels=channels, duration_ms=1.0)
+
+    assert built.to_schedule() == band_scheduler(nodes=nodes, channels=channels, duration_ms=1.0)
+
+
+def test_build_band_schedule_large():
+    f_sampling = 44100
+    channels = 1000.0 + get_minimum_channel_width(f_sampling) * np.arange(20)
+    nodes = [str(i) for i in range(100000)]
+
+    built = build_band_schedule(nodes=nodes, channels=channels, duration_ms=1.0, sampling_freq_hz=f_sampling)
+    report = validate_schedule(built, f_sampling)
+
+    assert len(built.ids) == len(nodes)
+    np.testing.assert_array_equal(report.channels_hz, channels)
+    np.testing.assert_array_equal(report.channel_load, np.full(20, 5000))
+    assert report.round_duration_s == pytest.approx(5000 * .02 + .01)
+
+
+def test_validate_schedule_report():
+    schedule = band_scheduler(nodes=['1', '2', '3'], channels=[2000.0, 1000.0], duration_ms=1.0)
+
+    report = validate_schedule(schedule, 44100)
+
+    np.testing.assert_array_equal(report.channels_hz, [1000.0, 2000.0])
+    np.testing.assert_array_equal(report.channel_load, [1, 2])
+    assert report.round_duration_s == pytest.approx(.05)
+
+
+def test_validate_schedule_nyquist():
+    schedule = single_tone_scheduler(nodes=['1', '2'], target_hz=12000.0, duration_ms=1.0)
+
+    with pytest.raises(ValueError, match="Nyquist"):
+        validate_schedule(schedule, 22050)
+
+
+def test_validate_schedule_channel_width():
+    schedule = band_scheduler(nodes=['1', '2'], channels=[1000.0, 1100.0], duration_ms=1.0)
+
+    with pytest.raises(ValueError, match="minimum channel width"):
+        validate_schedule(schedule, 44100)
+
+
+def test_validate_schedule_spacing():
+    arrays = build_band_schedule(nodes=['1', '2', '3'], channels=[1000.0], duration_ms=1.0)
+    arrays.time_s[2] = arrays.time_s[1] + .01
+
+    with pytest.raises(ValueError, match="2 and 3 beep on 1000.0 Hz"):
+        validate_schedule(arrays, 44100)
+
+
+def test_validate_schedule_early_window():
+    schedule = single_tone_scheduler(nodes=['1'], target_hz=1000.0, duration_ms=1.0)
+    schedule[0]["time_s"] = .005
+
+    with pytest.raises(ValueError, match="starts before the recording"):
+        validate_schedule(ScheduleArrays.from_schedule(schedule), 44100)
+
+
+def test_validate_schedule_mixed_durations():
+    schedule = band_scheduler(nodes=['1', '2'], channels=[1000.0, 2000.0], duration_ms=1.0)
+    schedule[1]["duration_ms"] = 2.0
+
+    with pytest.raises(ValueError, match="same duration_ms"):
+        validate_schedule(schedule, 44100)
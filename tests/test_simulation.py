@@ -0,0 +1,59 @@
+import numpy as np
+
+from pybeepbeep.ranging import calculate_distances, find_deltas
+from pybeepbeep.simulation import iter_recordings, pairwise_distances
+
+from tests.rounds import simulate_schedule
+
+
+distance_accuracy_threshold_m = .01
+
+
+def test_pairwise_distances():
+    positions = np.array([[0, 0], [3, 4], [6, 8]])
+
+    expected_distances = np.array([[0, 5, 10],
+                                   [5, 0, 5],
+                                   [10, 5, 0]])
+
+    assert np.allclose(pairwise_distances(positions), expected_distances)
+
+
+def test_simulated_round_ranging():
+    f_sampling = 44100.0
+    positions = {'1': (0.0, 0.0), '2': (1.5, 0.0), '3': (0.0, 2.0), '4': (3.0, 4.0)}
+    schedule, simulated = simulate_schedule(positions, f_sampling, clock_offsets_s={'2': .02, '4': -.01})
+
+    deltas = np.array([find_deltas(samples=recording, sampling_freq_hz=f_sampling, schedule=schedule, self_id=node)
+                       for node, recording in zip(simulated.ids, simulated.recordings)])
+
+    distances = calculate_distances(deltas=deltas, sampling_freq_hz=f_sampling)
+
+    assert simulated.ids == ['1', '2', '3', '4']
+    assert np.all(np.abs(distances - simulated.distances) < distance_accuracy_threshold_m)
+
+
+def test_streamed_recordings_match_round(tmp_path):
+    f_sampling = 44100.0
+    positions = {'1': (0.0, 0.0, 0.0), '2': (1.0, 2.0, 0.5), '3': (4.0, 0.0, 1.0)}
+    schedule, simulated = simulate_schedule(positions,
+                                            f_sampling,
+                                            target_hz=4000.0,
+                                            duration_ms=5.0,
+                                            duration_s=1.0,
+                                            noise_std=.01,
+                                            dtype=np.float32,
+                                            seed=7,
+                                            mmap_path=str(tmp_path / "round.npy"))
+
+    streamed = list(iter_recordings(positions=positions,
+                                    schedule=schedule,
+                                    sampling_freq_hz=f_sampling,
+                                    duration_s=1.0,
+                                    noise_std=.01,
+                                    dtype=np.float32,
+                                    seed=7))
+
+    assert [node for node, _ in streamed] == simulated.ids
+    assert np.array_equal(np.stack([recording for _, recording in streamed]), simulated.recordings)
+    assert np.array_equal(np.load(str(tmp_path / "round.npy")), simulated.recordings)
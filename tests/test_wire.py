@@ -0,0 +1,112 @@
+import json
+
+import numpy as np
+
+from pybeepbeep.ranging import band_scheduler, calculate_distances, generate_schedule, index_distances
+from pybeepbeep.wire import decode_deltas, decode_distances, decode_indexed_distances, decode_schedule, \
+    encode_deltas, encode_distances, encode_indexed_distances, encode_schedule
+
+import pytest
+
+
+def test_schedule_round_trip():
+    nodes = [str(i) for i in range(100)]
+
+    schedule = generate_schedule(nodes=nodes,
+                                 schedule_strategy=band_scheduler,
+                                 scheduler_kwargs={
+                                     "channels": [1000.0, 2000.0, 3000.0],
+                                     "duration_ms": 1.0
+                                 })
+
+    data = encode_schedule(schedule)
+
+    assert decode_schedule(data) == schedule
+    assert len(data) < len(json.dumps(schedule)) / 4
+
+
+def test_schedule_round_trip_preserves_json():
+    # the default scheduler arguments are ints
+    schedule = generate_schedule(nodes=['1', '2', '3'])
+    schedule[1]["time_s"] = 1.234
+
+    decoded = decode_schedule(encode_schedule(schedule))
+
+    assert json.dumps(decoded) == json.dumps(schedule)
+
+    # ids that are ints stay ints, even next to a string that spells the same number
+    schedule = generate_schedule(nodes=[1, 2, '2'])
+    decoded = decode_schedule(encode_schedule(schedule))
+
+    assert json.dumps(decoded) == json.dumps(schedule)
+    assert [entry["id"] for entry in decoded] == [1, 2, '2']
+
+
+def test_schedule_rejects_unknown_keys():
+    with pytest.raises(ValueError):
+        encode_schedule([{"id": "1", "target_hz": 1000.0, "duration_ms": 1.0, "time_s": 1.0, "gain": 1.0}])
+
+
+def test_deltas_round_trip():
+    ids = ['1', '2', '3']
+    row = np.array([0, 300, np.inf])
+    matrix = np.array([[0, 300, np.inf], [300, 0, 500], [np.inf, 500, 0]])
+
+    decoded_ids, decoded_row = decode_deltas(encode_deltas(row, ids))
+    assert decoded_ids == ids
+    assert np.array_equal(decoded_row, row)
+
+    decoded_ids, decoded_matrix = decode_deltas(encode_deltas(matrix, ids))
+    assert decoded_ids == ids
+    assert np.array_equal(decoded_matrix, matrix)
+    assert not decoded_matrix.flags.owndata
+
+
+def test_distances_round_trip():
+    ids = ['a', 'b', 'c', 'd']
+    deltas = np.array([[10, 300, 3000, 30000],
+                       [600, 20, 300000, 3000000],
+                       [3500, 299700, 30, 30000000],
+                       [30800, 2999500, 29999200, 40]])
+    distances = calculate_distances(deltas=deltas, sampling_freq_hz=44100)
+
+    decoded_ids, decoded = decode_distances(encode_distances(distances, ids))
+    assert decoded_ids == ids
+    assert decoded.dtype == np.float32
+    assert np.array_equal(decoded, distances.astype(np.float32))
+
+    decoded_ids, packed = decode_distances(encode_distances(distances, ids), packed=True)
+    assert np.array_equal(packed, distances[np.triu_indices(4)].astype(np.float32))
+
+    decoded_ids, decoded = decode_distances(encode_distances(distances, ids, dtype=np.float64))
+    assert np.array_equal(decoded, distances)
+
+
+def test_indexed_distances_round_trip():
+    distances = np.array([[0, 3, 4, 5],
+                          [3, 0, 6, 7],
+                          [4, 6, 0, 7],
+                          [5, 7, 7, 0]])
+    schedule = [{"id": "1"}, {"id": "2"}, {"id": "3"}, {"id": "4"}]
+    indexed = index_distances(distances, schedule)
+
+    assert decode_indexed_distances(encode_indexed_distances(indexed)) == indexed
+
+
+def test_indexed_distances_round_trip_calculated():
+    rng = np.random.default_rng(2)
+    deltas = np.abs(rng.normal(size=(5, 5)) * 1000).round()
+    schedule = [{"id": str(i)} for i in range(5)]
+    indexed = index_distances(calculate_distances(deltas, 44100.0), schedule)
+
+    assert decode_indexed_distances(encode_indexed_distances(indexed)) == indexed
+
+
+def test_decode_rejects_other_messages():
+    data = encode_deltas(np.zeros(2), ['1', '2'])
+
+    with pytest.raises(ValueError):
+        decode_schedule(data)
+
+    with pytest.raises(ValueError):
+        decode_schedule(b"not a message")